@@ -0,0 +1,377 @@
+# Standard
+from typing import Callable, Iterator
+import gc
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+# Local
+from utils.module import Module
+from utils.token import Token, TokenType
+from utils.error import Error, ErrorType
+
+
+class CharModule(Module):
+    """Module with the previous tokenizer, which calls a mode handler for every char
+
+    It is the reference for the pattern tokenizer of Module, which needs to emit the same
+    tokens.
+    """
+
+    def __init__(self, code: str, path: str) -> None:
+
+        super().__init__(code, path, {})
+
+        self.tokens: list[Token] = []
+        self.tokenize_mode: Callable[[int, str, int, str], bool] = self.tokenize_mode_normal
+        self.tokenize_data: dict = {}
+
+    def tokenize(self) -> Iterator[list[Token]]:
+        """Tokenize the lines char by char"""
+
+        # Loop through each line
+        for line, code in enumerate(self.read_lines()):
+
+            # Reset tokens, mode and data
+            self.tokens = []
+            self.tokenize_mode = self.tokenize_mode_normal
+            self.tokenize_data.clear()
+
+            # Loop through each char
+            for column, char in enumerate(code):
+
+                # Handle char in mode and skip to next line, if true
+                if self.tokenize_mode(line, code, column, char):
+                    break
+
+            yield self.tokens
+
+    def tokenize_mode_normal(self, line: int, code: str, column: int, char: str) -> bool:
+        """Tokenize a char in normal mode"""
+
+        processed = False
+
+        # Match char
+        match char:
+            case ";":
+                self.tokens.append(Token(TokenType.COMMENT, line, column, code[column + 1:-1]))
+                self.tokens.append(Token(TokenType.NEWLINE, line, len(code) - 1))
+                return True
+            case "\n":
+                self.tokens.append(Token(TokenType.NEWLINE, line, len(code) - 1))
+                processed = True
+            case ":":
+                self.tokens.append(Token(TokenType.COLON, line, column))
+                processed = True
+            case ",":
+                self.tokens.append(Token(TokenType.COMMA, line, column))
+                processed = True
+            case "/" | "\\":
+                self.tokens.append(Token(TokenType.SLASH, line, column))
+                processed = True
+            case "@":
+                self.tokens.append(Token(TokenType.AT, line, column))
+                processed = True
+            case "$":
+                self.tokens.append(Token(TokenType.DOLLAR, line, column))
+                processed = True
+            case "*":
+                self.tokens.append(Token(TokenType.ASTERISK, line, column))
+                processed = True
+            case "'" | '"':
+                self.tokenize_data["value"] = ""
+                self.tokenize_mode = self.tokenize_mode_string
+                processed = True
+            case "%":
+                self.tokenize_data["value"] = ""
+                self.tokenize_mode = self.tokenize_mode_argument
+                processed = True
+
+        # Check for value mode
+        if char in string.digits:
+            self.tokenize_data["value"] = char
+            self.tokenize_data["type"] = TokenType.DECIMAL
+            self.tokenize_mode = self.tokenize_mode_value
+            processed = True
+
+        # Check for name mode
+        elif char in string.ascii_letters + "_.":
+            self.tokenize_data["value"] = char
+            self.tokenize_mode = self.tokenize_mode_name
+            processed = True
+
+        # Check for space
+        if char in ("\t", " "):
+            if "space" not in self.tokenize_data:
+                self.tokens.append(Token(TokenType.SPACE, line, column))
+                self.tokenize_data["space"] = None
+            processed = True
+        else:
+            if "space" in self.tokenize_data:
+                del self.tokenize_data["space"]
+
+        # Raise error, if the char couldn't processed
+        if not processed:
+            Error(self, line, ErrorType.SYNTAX, f"Unknown char {char!r}! Hint: Names are only allowed to contain\n" +
+                  f"the following characters and can't start with a digit:\n_{string.ascii_letters}{string.digits}").exit()
+
+        return False
+
+    def tokenize_mode_string(self, line: int, code: str, column: int, char: str) -> bool:
+        """Tokenize a char in string mode"""
+
+        # Raise error, if the string was not closed until the end of the line
+        if char == "\n":
+            Error(self, line, ErrorType.SYNTAX,
+                  "String was not closed until the end of the line!").exit()
+
+        # Check for string closing
+        elif char in ("'", '"'):
+            self.tokens.append(Token(TokenType.STRING, line,
+                column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
+            self.tokenize_data.clear()
+            self.tokenize_mode = self.tokenize_mode_normal
+            return False
+
+        # Add the char
+        self.tokenize_data["value"] += char
+
+        return False
+
+    def tokenize_mode_value(self, line: int, code: str, column: int, char: str) -> bool:
+        """Tokenize a char in value mode"""
+
+        # Ignore underscore char
+        if char == "_":
+            return False
+
+        # Define allowed chars
+        if len(self.tokenize_data["value"]) == 1 and self.tokenize_data["type"] == TokenType.DECIMAL:
+            allowed = string.hexdigits + "xobXOB"
+        else:
+            allowed = string.hexdigits
+
+        # Check for the end of the value
+        if char not in allowed:
+            if len(self.tokenize_data["value"]) == 0:
+                Error(self, line, ErrorType.SYNTAX, f"Empty {self.tokenize_data['type'].value} value definition!").exit()
+            self.tokens.append(Token(self.tokenize_data["type"], line,
+                column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
+            self.tokenize_data.clear()
+            self.tokenize_mode = self.tokenize_mode_normal
+            return self.tokenize_mode(line, code, column, char)
+
+        # Check for value type definition
+        if len(self.tokenize_data["value"]) == 1 and self.tokenize_data["type"] == TokenType.DECIMAL:
+
+            # If the value type is decimal, add the char
+            if char in string.digits:
+                self.tokenize_data["value"] += char
+                return False
+
+            # Raise error, if the first char is not 0
+            if self.tokenize_data["value"] != "0":
+                Error(self, line, ErrorType.SYNTAX, "The first digit of a non-decimal value definition" +
+                      f" need to be 0, not {self.tokenize_data['value']!r}!").exit()
+
+            # If the type is valid, set it up, else, raise error
+            token_type = {"x": TokenType.HEXADECIMAL, "o": TokenType.OCTAL, "b": TokenType.BINARY}
+            if char.lower() not in token_type:
+                Error(self, line, ErrorType.SYNTAX,
+                    f"Invalid char {char!r} in decimal value definition!").exit()
+            self.tokenize_data["type"] = token_type[char.lower()]
+            self.tokenize_data["value"] = ""
+            return False
+
+        # Raise error, if the type don't support the char
+        if self.tokenize_data["type"] != TokenType.HEXADECIMAL:
+            allowed = {TokenType.DECIMAL: string.digits, TokenType.OCTAL: string.octdigits, TokenType.BINARY: "01"}
+            if char not in allowed[self.tokenize_data["type"]]:
+                Error(self, line, ErrorType.SYNTAX,
+                      f"Invalid char {char!r} in {self.tokenize_data['type'].value} value definition!").exit()
+
+        # Add the char
+        self.tokenize_data["value"] += char
+
+        return False
+
+    def tokenize_mode_name(self, line: int, code: str, column: int, char: str) -> bool:
+        """Tokenize a char in name mode"""
+
+        # Check for the end of the name
+        if char not in string.ascii_letters + string.digits + "_.":
+
+            # Check for keywords
+            keywords = {"include": TokenType.INCLUDE, "export": TokenType.EXPORT,
+                        "code": TokenType.CODE, "const": TokenType.CONSTANT,
+                        "var": TokenType.VARIABLE, "res": TokenType.RESOURCE}
+            if self.tokenize_data["value"].lower() in keywords:
+                self.tokens.append(Token(keywords[self.tokenize_data["value"].lower()], line,
+                    column - len(self.tokenize_data["value"])))
+
+            # Check for registers
+            elif len(self.tokenize_data["value"]) == 1 and self.tokenize_data["value"].lower() in "abcdhlzf":
+                self.tokens.append(Token(TokenType.REGISTER, line, column - 1, self.tokenize_data["value"].lower()))
+
+            # Normal name
+            else:
+                self.tokens.append(Token(TokenType.NAME, line,
+                    column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
+
+            self.tokenize_data.clear()
+            self.tokenize_mode = self.tokenize_mode_normal
+            return self.tokenize_mode(line, code, column, char)
+
+        # Add the char
+        self.tokenize_data["value"] += char
+
+        return False
+
+    def tokenize_mode_argument(self, line: int, code: str, column: int, char: str) -> bool:
+        """Tokenize a char in argument mode"""
+
+        # Check first char
+        if len(self.tokenize_data["value"]) == 0:
+            if char not in "ria":
+                Error(self, line, ErrorType.SYNTAX,
+                    f"The first char of a argument definition must be 'r', 'i' or 'a', not {char!r}!").exit()
+
+        # Check second char
+        elif len(self.tokenize_data["value"]) == 1:
+            if char not in string.digits:
+                Error(self, line, ErrorType.SYNTAX,
+                    f"The second char of a argument definition must be a digit, not {char!r}!").exit()
+
+        # Add the argument
+        else:
+            self.tokens.append(Token(TokenType.ARGUMENT, line, column - 3, self.tokenize_data["value"]))
+            self.tokenize_data.clear()
+            self.tokenize_mode = self.tokenize_mode_normal
+            return self.tokenize_mode(line, code, column, char)
+
+        # Add the char
+        self.tokenize_data["value"] += char
+
+        return False
+
+
+def generate(lines: int, seed: int = 0) -> str:
+    """Generate a large module with all kinds of tokens"""
+
+    rng = random.Random(seed)
+    names = ["loop", "counter", "value_1", "buffer.start", "_tmp", "Data", "x2", "PORT_GPU"]
+    values = ["0", "7", "1_000", "0x1F", "0XfF_00", "0b1010_0101", "0o17", "0_x2a", "255"]
+
+    result = ["; Generated module", "include stdlib/math", 'include "lib.asmn1"', "export main", ""]
+    result += [f"const {rng.choice(names)}_{i}\t{rng.choice(values)}" for i in range(lines // 20)]
+    result += [f"var buffer_{i} {rng.choice(values)}  ; buffer" for i in range(lines // 40)]
+    result += [f"res text_{i} 'text {i}'" for i in range(lines // 40)]
+    result += ["", "@macro", "swap %r0, %r1:", "    pushr %r0", "    mvr %r0, %r1", "    pop %r1", "", "code", ""]
+
+    while len(result) < lines:
+        choice = rng.random()
+        if choice < 0.1:
+            result.append(f"{rng.choice(names)}_{len(result)}:")
+        elif choice < 0.15:
+            result.append("@func")
+        elif choice < 0.25:
+            result.append(f"    ; {rng.choice(names)} comment with 'quotes' and symbols ,:/")
+        elif choice < 0.3:
+            result.append("")
+        else:
+            register = rng.choice("abcdhlzfABCDHLZF")
+            argument = rng.choice([rng.choice(values), rng.choice("abcdhlzf"), "$" + rng.choice(names), "*"])
+            comment = "  ; " + rng.choice(names) if rng.random() < 0.3 else ""
+            result.append(f"    {rng.choice(['mvi', 'MVR', 'addi', 'outi', 'sbbr'])} {register},\t{argument}{comment}")
+
+    return "\n".join(result) + "\n"
+
+
+def create(cls: type[Module], code: str) -> Module:
+    return cls(code, "benchmark.asmn1") if cls is CharModule else cls(code, "benchmark.asmn1", {})
+
+
+def tokens(module: Module) -> list[Token]:
+    """Get the tokens of all lines, the token line of the pattern tokenizer is only valid until the next line"""
+
+    if isinstance(module, CharModule):
+        return [token for line in module.tokenize() for token in line]
+
+    return [view.token() for line in module.tokenize() for view in module.line_store.views(line)]
+
+
+def measure(cls: type[Module], code: str, repeat: int) -> tuple[float, list[Token]]:
+    """Get the best tokenize time of some runs and the tokens"""
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        module = create(cls, code)
+        gc.disable()
+        start = time.perf_counter()
+        for _ in module.tokenize():
+            pass
+        best = min(best, time.perf_counter() - start)
+        gc.enable()
+
+    return best, tokens(create(cls, code))
+
+
+def memory(cls: type[Module], code: str) -> int:
+    """Get the memory of the tokens, which are kept for the lifetime of a module
+
+    The previous parser kept the tokens of all lines, the pattern parser only the tokens of the abstract lines.
+    """
+
+    module = create(cls, code)
+
+    tracemalloc.start()
+    if isinstance(module, CharModule):
+        kept = list(module.tokenize())
+    else:
+        for line in module.tokenize():
+            module.abstract(line)
+        kept = module.store
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del kept
+    return size
+
+
+def main(args: list[str]) -> int:
+    """Compare the tokenizers and token representations on a generated module with the given number of lines"""
+
+    lines = int(args[1]) if len(args) > 1 else 20_000
+    repeat = int(args[2]) if len(args) > 2 else 3
+
+    code = generate(lines)
+    print(f"Tokenize {lines} lines ({len(code)} chars), best of {repeat}")
+
+    char_time, char_tokens = measure(CharModule, code, repeat)
+    pattern_time, pattern_tokens = measure(Module, code, repeat)
+
+    if char_tokens != pattern_tokens:
+        index = next((i for i, (a, b) in enumerate(zip(char_tokens, pattern_tokens)) if a != b),
+                     min(len(char_tokens), len(pattern_tokens)))
+        print(f"Different tokens at index {index}!")
+        print("Char:   ", char_tokens[index:index + 3])
+        print("Pattern:", pattern_tokens[index:index + 3])
+        return 1
+
+    print(f"Tokens:  {len(pattern_tokens)} (identical)")
+    print(f"Char:    {char_time * 1000:.1f} ms")
+    print(f"Pattern: {pattern_time * 1000:.1f} ms ({char_time / pattern_time:.1f}x)")
+
+    char_memory, pattern_memory = memory(CharModule, code), memory(Module, code)
+    print(f"Memory:  {char_memory / 2 ** 20:.1f} MiB as tokens, {pattern_memory / 2 ** 20:.1f} MiB kept by the parsed module")
+
+    return 0
+
+
+# Main
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv))
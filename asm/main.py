@@ -1,11 +1,19 @@
 # Standard
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import Iterator
 import sys
 import os
 
+# Shared
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/../common")
+from common import disassemble
+
 # Local
 from utils.module import Module
+from utils.definition import Include
 from utils.token import Token, TokenType, token_list_remove
-from utils.error import Error, ErrorType
+from utils.error import Error, ErrorType, ErrorExit
+from utils import cache as module_cache
 
 
 STDLIB = os.path.dirname(__file__) + "/stdlib"
@@ -52,23 +60,135 @@ def get_path(main_path: str, path: str) -> str:
         return os.path.abspath(STDLIB + "/" + path + ".asmn1")
 
 
-def load_module(modules: dict[str, Module], path: str, debug: bool, main_path: str, main: bool = False) -> None:
-    """Load a module"""
+def print_tokens(module: Module, token_lines: Iterator[range]) -> Iterator[range]:
+    """Print the tokens of each line before passing it on"""
+
+    for line in token_lines:
+        for index in line:
+            print(module.line_store[index])
+        yield line
+
+
+def include_path(main_path: str, include: Include) -> str | None:
+    """Get the real path of an include or None, if it is invalid or not found"""
+
+    if include.string:
+        return get_path(main_path, include.path[0].value)
+
+    if token_list_remove(token_list_remove(include.path, TokenType.SLASH), TokenType.NAME):
+        return None
+
+    path = ""
+    for token in include.path:
+        path += token.value if token.type == TokenType.NAME else "/"
+    return get_path(main_path, path)
+
+
+def parse_module(path: str, main: bool, cache: bool) -> tuple[tuple | None, tuple | None, bool]:
+    """Parse a module in a worker process
+
+    Return the packed parse results or the error (line, type, message) and if the module
+    was loaded from the cache.
+    """
+
+    module = Module.file(path, {}, main)
+
+    if cache and module_cache.load(module):
+        return module_cache.pack(module), None, True
+
+    try:
+        module.parse()
+    except ErrorExit as exit_:
+        return None, (exit_.error.line, exit_.error.type, exit_.error.message), False
+
+    if cache:
+        module_cache.save(module)
+
+    return module_cache.pack(module), None, False
+
+
+def parse_modules(file: str, cache: bool, jobs: int = 0) -> dict[str, tuple]:
+    """Parse all modules of the include graph in a process pool (0 jobs = one per core)
+
+    A module is submitted as soon as a parsed module includes it, so independent modules
+    are parsed at the same time. Invalid includes are skipped, load_module() reports them.
+    """
+
+    builtins = os.path.abspath(STDLIB + "/builtins.asmn1")
+    results: dict[str, tuple] = {}
+
+    with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+
+        futures: dict[Future, str] = {}
+        pending: set[Future] = set()
+
+        def submit(path: str, main: bool = False) -> None:
+            future = executor.submit(parse_module, path, main, cache)
+            futures[future] = path
+            pending.add(future)
+
+        submit(file, True)
+        submit(builtins)
+
+        while pending:
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+
+                pending.remove(future)
+
+                path = futures[future]
+                results[path] = future.result()
+
+                packed = results[path][0]
+                if packed is None:
+                    continue
+
+                module = Module.file(path, {})
+                module_cache.unpack(module, packed)
+
+                for include in module.includes:
+                    path = include_path(file, include)
+                    if path is not None and path not in futures.values():
+                        submit(path)
+
+    return results
+
+
+def load_module(modules: dict[str, Module], path: str, debug: bool, main_path: str, main: bool = False,
+                cache: bool = True, parsed: dict[str, tuple] | None = None) -> None:
+    """Load a module from the results of parse_modules(), the cache or by parsing it
+
+    The modules are loaded depth-first in include order, so they are in the same order
+    and the same error is reported, however they were parsed.
+    """
 
     print(f"Load module '{path}'")
 
     module = Module.file(path, modules, main)
 
-    print("Tokenize ...")
-    module.tokenize()
+    if parsed is not None and path in parsed:
+        packed, error, cached = parsed[path]
+        print("Load from cache ..." if cached else "Tokenize and parse ...")
+        if error is not None:
+            Error(module, *error).exit()
+        module_cache.unpack(module, packed)
 
-    if debug:
-        for line in module.token_lines:
-            for token in line:
-                print(token)
+    elif cache and module_cache.load(module):
+        print("Load from cache ...")
+
+    else:
+        print("Tokenize and parse ...")
+        token_lines = module.tokenize()
+
+        if debug:
+            token_lines = print_tokens(module, token_lines)
 
-    print("Parse ...")
-    module.parse()
+        module.parse(token_lines)
+
+        if cache:
+            module_cache.save(module)
 
     if debug:
         for include in module.includes:
@@ -91,24 +211,20 @@ def load_module(modules: dict[str, Module], path: str, debug: bool, main_path: s
     modules[path] = module
 
     if os.path.abspath(STDLIB + "/builtins.asmn1") not in modules:
-        load_module(modules, os.path.abspath(STDLIB + "/builtins.asmn1"), debug, main_path)
+        load_module(modules, os.path.abspath(STDLIB + "/builtins.asmn1"), debug, main_path, cache=cache,
+                    parsed=parsed)
 
     if path != os.path.abspath(STDLIB + "/builtins.asmn1"):
         module.include_paths.append(path)
 
     for include in module.includes:
 
-        if len(include.path) == 1 and include.path[0].type == TokenType.STRING:
-            path = get_path(main_path, include.path[0].value)
-        elif token_list_remove(token_list_remove(include.path, TokenType.SLASH), TokenType.NAME):
+        if not include.string and token_list_remove(token_list_remove(include.path, TokenType.SLASH), TokenType.NAME):
             Error(module, include.path[0].line, ErrorType.SYNTAX,
                   "Invalid include definition!\n" +
                   "One string or a combination of names and slashes is expected.").exit()
-        else:
-            path = ""
-            for token in include.path:
-                path += token.value if token.type == TokenType.NAME else "/"
-            path = get_path(main_path, path)
+
+        path = include_path(main_path, include)
 
         if path is None:
             Error(module, include.path[0].line, ErrorType.INCLUDE,
@@ -117,10 +233,10 @@ def load_module(modules: dict[str, Module], path: str, debug: bool, main_path: s
         module.include_paths.append(path)
 
         if path not in modules:
-            load_module(modules, path, debug, main_path)
+            load_module(modules, path, debug, main_path, cache=cache, parsed=parsed)
 
 
-def mode_default(file: str, override: bool, debug: bool) -> int:
+def mode_default(file: str, override: bool, debug: bool, cache: bool = True, jobs: int = 0) -> int:
 
     if os.path.splitext(file)[1] not in (".asm", ".asmn1"):
         print("Invalid file type! File extension needs to be '.asm' or '.asmn1'. Type '-h' for help ...")
@@ -136,15 +252,18 @@ def mode_default(file: str, override: bool, debug: bool) -> int:
 
     modules: dict = {}
 
-    load_module(modules, file, debug, file, True)
+    # The tokens are printed while parsing, so the modules are parsed one by one for debugging
+    parsed = parse_modules(file, cache, jobs) if not debug and jobs != 1 else None
+
+    load_module(modules, file, debug, file, True, cache, parsed)
 
     return 0
 
 
-def mode_mc_schem(file: str, override: bool, debug: bool) -> int:
+def mode_mc_schem(file: str, override: bool, debug: bool, cache: bool = True, jobs: int = 0) -> int:
 
     if os.path.splitext(file)[1] in (".asm", ".asmn1"):
-        exit_code = mode_default(file, override, debug)
+        exit_code = mode_default(file, override, debug, cache, jobs)
         if exit_code != 0:
             return exit_code
         file = os.path.splitext(file)[0] + ".n1"
@@ -162,8 +281,32 @@ def mode_regenerate(file: str, override: bool, debug: bool) -> int:
         print("Invalid file type! File extension needs to be '.n1'. Type '-h' for help ...")
         return 1
 
+    if not override:
+        for path in (os.path.splitext(file)[0] + ".asmn1",):
+            if os.path.exists(path):
+                print(f"The file '{path}' already exists. Use '-o' to overwrite it ...")
+                return 1
+
     print(f"Regenerate from file '{file}'")
 
+    with open(file, "r") as f:
+        string = "".join(f.read().split())
+
+    data = int(string, 2).to_bytes(len(string) // 8, "big") if string else b""
+
+    lines = disassemble(data)
+
+    if debug:
+        for addr, line in lines:
+            print(f"0x{addr:04X}  {line}")
+
+    with open(os.path.splitext(file)[0] + ".asmn1", "w") as f:
+        f.write("code\n\nmain:\n")
+        for addr, line in lines:
+            f.write(f"    {line:<24}; 0x{addr:04X}\n")
+
+    return 0
+
 
 def main(args: list[str]) -> int:
     """The main function of the assembler"""
@@ -176,6 +319,8 @@ def main(args: list[str]) -> int:
     override: bool = "-o" in args
     debug: bool = "-d" in args
     regenerate: bool = "-r" in args
+    cache: bool = "--no-cache" not in args
+    jobs_args: list[str] = [arg for arg in args if arg.startswith("--jobs=")]
 
     if len(args) < 2:
         print("Missing arguments! Type '-h' for help ...")
@@ -185,7 +330,13 @@ def main(args: list[str]) -> int:
         print("Invalid combination of '-m' and '-r' flags! Type '-h' for help ...")
         return 1
 
-    if len([arg for arg in args if arg not in ("-m", "-o", "-d", "-r")]) != 2:
+    if jobs_args and not jobs_args[-1][7:].isdigit():
+        print("Invalid number of jobs! '--jobs=n' expects a number (0 = one per core). Type '-h' for help ...")
+        return 1
+
+    jobs: int = int(jobs_args[-1][7:]) if jobs_args else 0
+
+    if len([arg for arg in args if arg not in ("-m", "-o", "-d", "-r", "--no-cache") + tuple(jobs_args)]) != 2:
         print("Missing file argument! Type '-h' for help ...")
         return 1
 
@@ -200,13 +351,19 @@ def main(args: list[str]) -> int:
 
     file = os.path.abspath(file)
 
-    if mc_schem:
-        return mode_mc_schem(file, override, debug)
+    try:
 
-    if regenerate:
-        return mode_regenerate(file, override, debug)
+        if mc_schem:
+            return mode_mc_schem(file, override, debug, cache, jobs)
 
-    return mode_default(file, override, debug)
+        if regenerate:
+            return mode_regenerate(file, override, debug)
+
+        return mode_default(file, override, debug, cache, jobs)
+
+    except ErrorExit as exit_:
+        print(exit_.error.report())
+        return 1
 
 
 # Main
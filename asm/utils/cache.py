@@ -0,0 +1,196 @@
+# Standard
+from __future__ import annotations
+from array import array
+from typing import TYPE_CHECKING
+import hashlib
+import marshal
+import struct
+import sys
+import os
+
+# Local
+from utils.definition import Include, Export, Constant, Variable, Resource, Macro
+from utils.token import TokenStore, TokenView
+from utils.code import Instruction, Label
+
+if TYPE_CHECKING:
+    from utils.module import Module
+
+
+CACHE = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/.cache"
+
+MAGIC = b"N1C\0"
+
+# Sources of the tokenizer, the parser and the parse results, so any change to them invalidates the cache
+SOURCES = ("token.py", "definition.py", "code.py", "module.py", "cache.py")
+
+
+def source_version() -> bytes:
+    """Get the version of the parse results as the SHA-256 of the sources, which produce them"""
+
+    digest = hashlib.sha256()
+
+    for source in SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), source), "rb") as f:
+            digest.update(f.read())
+
+    return digest.digest()[:16]
+
+
+VERSION = source_version()
+
+# Magic, version, marshal version, modification time in ns, size, SHA-256 of the content
+HEADER = struct.Struct("<4s16sBxxxqQ32s")
+
+
+def cache_path(path: str) -> str:
+    """Get the path of the cache file of a module"""
+    return CACHE + "/" + hashlib.sha256(path.encode()).hexdigest()[:32] + ".cache"
+
+
+def content_hash(path: str) -> bytes:
+
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def load(module: Module) -> bool:
+    """Load the parse results of a module from its cache file, if it is still valid
+
+    The cache is valid, if the modification time and size of the module are the same or,
+    if they changed, the content hash is the same.
+    """
+
+    try:
+        with open(cache_path(module.path), "rb") as f:
+            data = f.read()
+        stat = os.stat(module.path)
+    except OSError:
+        return False
+
+    if len(data) < HEADER.size:
+        return False
+
+    magic, version, marshal_version, mtime, size, digest = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION or marshal_version != marshal.version:
+        return False
+
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        try:
+            if content_hash(module.path) != digest:
+                return False
+        except OSError:
+            return False
+        write(module.path, HEADER.pack(MAGIC, VERSION, marshal.version, stat.st_mtime_ns, stat.st_size, digest) +
+              data[HEADER.size:])
+
+    try:
+        unpack(module, marshal.loads(data[HEADER.size:]))
+    except (EOFError, ValueError, TypeError, IndexError):
+        return False
+
+    return True
+
+
+def save(module: Module) -> None:
+    """Save the parse results of a module to its cache file
+
+    The stat and hash are the ones of the bytes, which were actually parsed, so a file changed
+    while parsing is detected by the next load.
+    """
+
+    stat, digest = module.source_stat, module.source_hash
+
+    if stat is None or digest is None:
+        return
+
+    write(module.path, HEADER.pack(MAGIC, VERSION, marshal.version, stat.st_mtime_ns, stat.st_size, digest.digest()) +
+          marshal.dumps(pack(module)))
+
+
+def write(path: str, data: bytes) -> None:
+    """Write a cache file atomically and ignore errors, because the cache is optional"""
+
+    file = cache_path(path)
+
+    try:
+        os.makedirs(CACHE, exist_ok=True)
+        with open(file + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(file + ".tmp", file)
+    except OSError:
+        pass
+
+
+def pack(module: Module) -> tuple:
+    """Pack the parse results into plain data with a token store of only the used tokens"""
+
+    store = TokenStore()
+    indices: dict[int, int] = {}
+
+    def token(view: TokenView) -> int:
+        if view.index not in indices:
+            indices[view.index] = store.append(view.type, view.line, view.column, view.value)
+        return indices[view.index]
+
+    def instruction(instruction: Instruction) -> tuple:
+        return token(instruction.name), [token(argument) for argument in instruction.arguments]
+
+    def label(label: Label) -> tuple:
+        return token(label.name), label.pointer, label.function
+
+    data = (
+        [[token(part) for part in include.path] for include in module.includes],
+        [token(export.name) for export in module.exports],
+        [(token(constant.name), token(constant.value)) for constant in module.constants],
+        [(token(variable.name), token(variable.size)) for variable in module.variables],
+        [(token(resource.name), token(resource.value)) for resource in module.resources],
+        [(token(macro.name), [token(argument) for argument in macro.arguments],
+          [instruction(i) for i in macro.instructions], [label(l) for l in macro.labels]) for macro in module.macros],
+        [instruction(i) for i in module.instructions],
+        [label(l) for l in module.labels],
+    )
+
+    return (module.path, store.types.tobytes(), store.lines.tobytes(), store.columns.tobytes(),
+            store.values.tobytes(), store.strings, data)
+
+
+def unpack(module: Module, packed: tuple) -> None:
+    """Unpack the parse results into a module, which uses the token store of them"""
+
+    path, types, lines, columns, values, strings, data = packed
+
+    if path != module.path:
+        raise ValueError("Cache of another module")
+
+    store = TokenStore()
+    store.types, store.lines, store.columns, store.values = \
+        array("B", types), array("I", lines), array("I", columns), array("I", values)
+    store.strings = [None] + [sys.intern(string) for string in strings[1:]]
+    store.string_codes = {string: code for code, string in enumerate(store.strings) if code}
+
+    def token(index: int) -> TokenView:
+        if not 0 <= index < len(store):
+            raise IndexError("Token out of the store")
+        return TokenView(store, index)
+
+    def instruction(packed: tuple) -> Instruction:
+        return Instruction(token(packed[0]), [token(argument) for argument in packed[1]])
+
+    def label(packed: tuple) -> Label:
+        return Label(token(packed[0]), packed[1], packed[2])
+
+    includes, exports, constants, variables, resources, macros, instructions, labels = data
+
+    module.store = store
+    module.includes = [Include([token(part) for part in path]) for path in includes]
+    module.exports = [Export(token(name)) for name in exports]
+    module.constants = [Constant(token(name), token(value)) for name, value in constants]
+    module.variables = [Variable(token(name), token(size)) for name, size in variables]
+    module.resources = [Resource(token(name), token(value)) for name, value in resources]
+    module.macros = [Macro(token(name), [token(argument) for argument in arguments],
+                           [instruction(i) for i in macro_instructions], [label(l) for l in macro_labels])
+                     for name, arguments, macro_instructions, macro_labels in macros]
+    module.instructions = [instruction(i) for i in instructions]
+    module.labels = [label(l) for l in labels]
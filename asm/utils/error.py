@@ -3,7 +3,6 @@ from __future__ import annotations
 from typing import NoReturn, TYPE_CHECKING
 from dataclasses import dataclass
 from enum import StrEnum, auto
-import sys
 
 # Local
 if TYPE_CHECKING:
@@ -56,6 +55,8 @@ class Error:
 
     def report(self) -> str:
 
+        lines = self.module.lines
+
         result = "-" * 80 + "\n"
         result += "FATAL ERROR".center(80) + "\n"
         result += "-" * 80 + "\n\n"
@@ -64,10 +65,10 @@ class Error:
         if 0 < self.line - 6:
             result += "         ...\n\n"
         for i in range(self.line - 6, self.line + 7):
-            if 0 <= i < len(self.module.lines):
-                code = render_tabs(self.module.lines[i].replace("\n", ""))
+            if 0 <= i < len(lines):
+                code = render_tabs(lines[i].replace("\n", ""))
                 result += f"{'>>>' if i == self.line else '   '} {i + 1:<5}{code}\n"
-        if self.line + 7 < len(self.module.lines):
+        if self.line + 7 < len(lines):
             result += "\n         ...\n"
 
         result += "\n" + "-" * 80 + "\n\n"
@@ -77,8 +78,19 @@ class Error:
         return result
 
     def exit(self) -> NoReturn:
+        """Stop the assembler, the error is reported by the main function"""
+
+        raise ErrorExit(self)
+
+
+class ErrorExit(Exception):
+    """Exception to stop the assembler with an error
 
-        print(self.report())
+    Worker processes return the error to the main process instead of reporting it, so
+    errors are always reported in the same order.
+    """
 
-        sys.exit(1)
+    def __init__(self, error: Error) -> None:
+        super().__init__(error.message)
+        self.error: Error = error
 
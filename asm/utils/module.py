@@ -1,18 +1,65 @@
 # Standard
-from typing import Self, Callable
+from typing import Self, Callable, Iterable, Iterator
+import hashlib
 import string
+import re
+import os
 
 # Local
 from utils.definition import Include, Export, Constant, Variable, Resource, Macro
-from utils.token import Token, TokenType, token_list_contains, token_list_remove, token_list_split
+from utils.token import Token, TokenType, TokenStore, TokenView, TOKEN_CODES, token_list_contains, token_list_remove, \
+    token_list_split
 from utils.code import Instruction, Label
 from utils.error import Error, ErrorType
 
 
+# Pattern of all tokens, one named group per kind (values only match, if they are valid)
+TOKEN_PATTERN = re.compile(r"""
+      (?P<space>[ \t]+)
+    | (?P<name>[A-Za-z_.][A-Za-z0-9_.]*+)
+    | (?P<symbol>[:,/\\@$*])
+    | (?P<newline>\n)
+    | 0_*[xX](?P<hexadecimal>_*[0-9a-fA-F][0-9a-fA-F_]*+)
+    | 0_*[oO](?P<octal>_*[0-7][0-7_]*+)(?![89a-fA-F])
+    | 0_*[bB](?P<binary>_*[01][01_]*+)(?![2-9a-fA-F])
+    | (?P<decimal>[0-9]_*+(?:[0-9][0-9_]*+(?![a-fA-F])|(?![0-9a-fA-FxXoObB])))
+    | ["'](?P<string>[^"'\n]*)["']
+    | %(?P<argument>[ria][0-9])
+    | ;(?P<comment>.*)
+    | (?P<error>.)
+""", re.VERBOSE)
+
+SYMBOLS = {":": TOKEN_CODES[TokenType.COLON], ",": TOKEN_CODES[TokenType.COMMA], "/": TOKEN_CODES[TokenType.SLASH],
+           "\\": TOKEN_CODES[TokenType.SLASH], "@": TOKEN_CODES[TokenType.AT], "$": TOKEN_CODES[TokenType.DOLLAR],
+           "*": TOKEN_CODES[TokenType.ASTERISK]}
+
+KEYWORDS = {"include": TokenType.INCLUDE, "export": TokenType.EXPORT,
+            "code": TokenType.CODE, "const": TokenType.CONSTANT,
+            "var": TokenType.VARIABLE, "res": TokenType.RESOURCE}
+
+REGISTERS = "abcdhlzf"
+
+VALUES = {"decimal": TOKEN_CODES[TokenType.DECIMAL], "hexadecimal": TOKEN_CODES[TokenType.HEXADECIMAL],
+          "octal": TOKEN_CODES[TokenType.OCTAL], "binary": TOKEN_CODES[TokenType.BINARY]}
+
+PREFIXES = {"x": TokenType.HEXADECIMAL, "o": TokenType.OCTAL, "b": TokenType.BINARY}
+
+DIGITS = {TokenType.DECIMAL: string.digits, TokenType.OCTAL: string.octdigits, TokenType.BINARY: "01"}
+
+# Size of the string table of the line store, after which it is cleared with the next line
+LINE_STRINGS = 4096
+
+
 class Module:
-    """Module for parsing"""
+    """Module for parsing
+
+    The lines are read, tokenized and parsed one by one, so only the current line is kept.
+    Each line is tokenized into a scratch store and only the tokens of its abstract line are
+    copied into the compact token store of the module, which the parser gets views of.
+    Without code, the lines are read from the file at the path.
+    """
 
-    def __init__(self, code: str, path: str, modules: dict[str, Self], main: bool = False) -> None:
+    def __init__(self, code: str | None, path: str, modules: dict[str, Self], main: bool = False) -> None:
 
         # General data
         self.path: str = path
@@ -20,13 +67,13 @@ class Module:
         self.modules: dict[str, Module] = modules
 
         # Text data
-        self.code: str = code
-        self.lines: list[str] = [line + "\n" for line in code.splitlines()]
+        self.code: str | None = code
+        self.source_stat: os.stat_result | None = None  # Stat of the file, when it was opened for reading
+        self.source_hash: hashlib._Hash | None = None  # SHA-256 of the bytes read from the file
 
         # Token data
-        self.tokens: list[Token] = []
-        self.token_lines: list[list[Token]] = []
-        self.abstract_lines: list[list[Token]] = []
+        self.store: TokenStore = TokenStore()
+        self.line_store: TokenStore = TokenStore()
 
         # Parse data
         self.includes: list[Include] = []
@@ -42,9 +89,8 @@ class Module:
         self.include_paths: list[str] = []
 
         # Temporary data
-        self.tokenize_mode: Callable[[Module, int, str, int, str], bool] = self.tokenize_mode_normal
-        self.tokenize_data: dict = {}
-        self.parse_mode: Callable[[Module, list[Token], list[Token]], None] = self.parse_mode_definition
+        self.tokenize_names: dict[str, tuple[int, int]] = {}
+        self.parse_mode: Callable[[list[TokenView]], None] = self.parse_mode_definition
         self.parse_data: dict = {}
 
     def get_reference(name: str, private: bool = False) -> str:
@@ -54,273 +100,231 @@ class Module:
 
 
 
-    def tokenize(self) -> None:
-        """Tokenize the lines"""
+    def read_lines(self) -> Iterator[str]:
+        """Read the lines one by one, each ending with a newline"""
 
-        # Loop through each line
-        for line, code in enumerate(self.lines):
+        if self.code is not None:
+            for line in self.code.splitlines():
+                yield line + "\n"
+            return
 
-            # Reset mode and data
-            self.tokenize_mode = self.tokenize_mode_normal
-            self.tokenize_data.clear()
+        with open(self.path, "rb") as f:
+            self.source_stat = os.fstat(f.fileno())
+            self.source_hash = hashlib.sha256()
+            for code in f:
+                self.source_hash.update(code)
+                for line in code.decode("utf-8").splitlines():
+                    yield line + "\n"
 
-            # Loop through each char
-            for column, char in enumerate(code):
+    @property
+    def lines(self) -> list[str]:
+        """Read all lines, only used to show the code around errors"""
+        return list(self.read_lines())
 
-                # Handle char in mode and skip to next line, if true
-                if self.tokenize_mode(line, code, column, char):
-                    break
+    def tokenize(self) -> Iterator[range]:
+        """Tokenize the lines one by one and get the indices of their tokens in the line store
 
-        # Split token lines
-        self.token_lines = token_list_split(self.tokens, TokenType.NEWLINE)
+        The indices are only valid until the next line is tokenized.
+        """
 
-        # Loop through each line
-        for tokens in self.token_lines:
+        for line, code in enumerate(self.read_lines()):
+            yield self.tokenize_line(line, code)
 
-            # Find the abstract start of the line
-            start = 0
-            for index, token in enumerate(tokens):
-                if token.type != TokenType.SPACE:
-                    start = index
-                    break
+    def tokenize_line(self, line: int, code: str) -> range:
+        """Tokenize a line into the cleared line store"""
 
-            # Find the abstract end of the line
-            end = len(tokens) - 1
-            for index, token in enumerate(reversed(tokens)):
-                if token.type != TokenType.SPACE and token.type != TokenType.NEWLINE:
-                    end = len(tokens) - index
-                    break
+        store = self.line_store
 
-            # Remove comments
-            abstract = token_list_remove(tokens[start:end], TokenType.COMMENT)
+        # Type and value codes of the names, which were already seen
+        names = self.tokenize_names
 
-            # Add the abstract line, if it is not empty
-            if abstract:
-                self.abstract_lines.append(abstract)
+        # Keep the string table of the line store and the codes of the names, until it gets too large
+        if len(store.strings) > LINE_STRINGS:
+            store.clear()
+            names.clear()
+        else:
+            store.clear(False)
+
+        # Arrays and token type codes as locals, because the attribute lookups are slow
+        types, lines, columns, values = store.types.append, store.lines.append, store.columns.append, \
+            store.values.append
+        intern = store.intern
+        space, name, register, newline, string_, argument, comment = (TOKEN_CODES[token_type] for token_type in (
+            TokenType.SPACE, TokenType.NAME, TokenType.REGISTER, TokenType.NEWLINE, TokenType.STRING,
+            TokenType.ARGUMENT, TokenType.COMMENT))
+
+        # Scan the line with the pattern and restart after values, which need to be scanned char by char
+        position = 0
+        while position < len(code):
+
+            for match in TOKEN_PATTERN.finditer(code, position):
+
+                kind = match.lastgroup
+                column = match.start()
+                value = 0
+
+                if kind == "space":
+                    token_type = space
+                elif kind == "name":
+                    value = match.group(kind)
+                    if value not in names:
+                        lower = value.lower()
+                        if lower in KEYWORDS:
+                            names[value] = (TOKEN_CODES[KEYWORDS[lower]], 0)
+                        elif len(value) == 1 and lower in REGISTERS:
+                            names[value] = (register, intern(lower))
+                        else:
+                            names[value] = (name, intern(value))
+                    token_type, value = names[value]
+                elif kind == "symbol":
+                    token_type = SYMBOLS[match.group(kind)]
+                elif kind == "newline":
+                    token_type = newline
+                elif kind in VALUES:
+                    token_type = VALUES[kind]
+                    value = match.group(kind).replace("_", "")
+                    column = match.end() - len(value)
+                    value = intern(value)
+                elif kind == "string":
+                    token_type, column, value = string_, match.start(kind), intern(match.group(kind))
+                elif kind == "argument":
+                    token_type, value = argument, intern(match.group(kind))
+                elif kind == "comment":
+                    token_type, value = comment, intern(match.group(kind))
+                else:
+                    token, position = self.tokenize_error(line, code, match.start())
+                    store.append(token.type, token.line, token.column, token.value)
+                    break
 
-    def tokenize_mode_normal(self, line: int, code: str, column: int, char: str) -> bool:
-        """Tokenize a char in normal mode"""
+                types(token_type)
+                lines(line)
+                columns(column)
+                values(value)
 
-        processed = False
+            else:
+                break
 
-        # Match char
-        match char:
-            case ";":
-                self.tokens.append(Token(TokenType.COMMENT, line, column, code[column + 1:-1]))
-                self.tokens.append(Token(TokenType.NEWLINE, line, len(code) - 1))
-                return True
-            case "\n":
-                self.tokens.append(Token(TokenType.NEWLINE, line, len(code) - 1))
-                processed = True
-            case ":":
-                self.tokens.append(Token(TokenType.COLON, line, column))
-                processed = True
-            case ",":
-                self.tokens.append(Token(TokenType.COMMA, line, column))
-                processed = True
-            case "/" | "\\":
-                self.tokens.append(Token(TokenType.SLASH, line, column))
-                processed = True
-            case "@":
-                self.tokens.append(Token(TokenType.AT, line, column))
-                processed = True
-            case "$":
-                self.tokens.append(Token(TokenType.DOLLAR, line, column))
-                processed = True
-            case "*":
-                self.tokens.append(Token(TokenType.ASTERISK, line, column))
-                processed = True
-            case "'" | '"':
-                self.tokenize_data["value"] = ""
-                self.tokenize_mode = self.tokenize_mode_string
-                processed = True
-            case "%":
-                self.tokenize_data["value"] = ""
-                self.tokenize_mode = self.tokenize_mode_argument
-                processed = True
-
-        # Check for value mode
-        if char in string.digits:
-            self.tokenize_data["value"] = char
-            self.tokenize_data["type"] = TokenType.DECIMAL
-            self.tokenize_mode = self.tokenize_mode_value
-            processed = True
-
-        # Check for name mode
-        elif char in string.ascii_letters + "_.":
-            self.tokenize_data["value"] = char
-            self.tokenize_mode = self.tokenize_mode_name
-            processed = True
-
-        # Check for space
-        if char in ("\t", " "):
-            if "space" not in self.tokenize_data:
-                self.tokens.append(Token(TokenType.SPACE, line, column))
-                self.tokenize_data["space"] = None
-            processed = True
-        else:
-            if "space" in self.tokenize_data:
-                del self.tokenize_data["space"]
+        return range(len(store))
 
-        # Raise error, if the char couldn't processed
-        if not processed:
-            Error(self, line, ErrorType.SYNTAX, f"Unknown char {char!r}! Hint: Names are only allowed to contain\n" +
-                  f"the following characters and can't start with a digit:\n_{string.ascii_letters}{string.digits}").exit()
+    def abstract(self, tokens: range) -> list[TokenView]:
+        """Copy the abstract line of a token line without spaces at the ends and comments into the store
+        and get views of it"""
 
-        return False
+        types = self.line_store.types
+        space, comment = TOKEN_CODES[TokenType.SPACE], TOKEN_CODES[TokenType.COMMENT]
 
-    def tokenize_mode_string(self, line: int, code: str, column: int, char: str) -> bool:
-        """Tokenize a char in string mode"""
+        # Find the abstract start of the line, the last token is always the newline
+        start = tokens.start
+        while start < tokens.stop - 1 and types[start] == space:
+            start += 1
 
-        # Raise error, if the string was not closed until the end of the line
-        if char == "\n":
-            Error(self, line, ErrorType.SYNTAX,
-                  "String was not closed until the end of the line!").exit()
+        # Find the abstract end of the line
+        end = tokens.stop - 1
+        while end > start and types[end - 1] == space:
+            end -= 1
 
-        # Check for string closing
-        elif char in ("'", '"'):
-            self.tokens.append(Token(TokenType.STRING, line,
-                column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
-            self.tokenize_data.clear()
-            self.tokenize_mode = self.tokenize_mode_normal
-            return False
+        # Remove comments
+        indices = self.store.copy(self.line_store, [index for index in range(start, end) if types[index] != comment])
 
-        # Add the char
-        self.tokenize_data["value"] += char
+        return self.store.views(indices)
 
-        return False
+    def tokenize_error(self, line: int, code: str, column: int) -> tuple[Token, int]:
+        """Tokenize a char, which is not matched by the pattern, and raise the error of it
 
-    def tokenize_mode_value(self, line: int, code: str, column: int, char: str) -> bool:
-        """Tokenize a char in value mode"""
+        Values, which are not matched, are scanned char by char, because most of their errors
+        depend on the chars before. Valid values are returned with the column after them.
+        """
 
-        # Ignore underscore char
-        if char == "_":
-            return False
+        char = code[column]
 
-        # Define allowed chars
-        if len(self.tokenize_data["value"]) == 1 and self.tokenize_data["type"] == TokenType.DECIMAL:
-            allowed = string.hexdigits + "xobXOB"
-        else:
-            allowed = string.hexdigits
-
-        # Check for the end of the value
-        if char not in allowed:
-            if len(self.tokenize_data["value"]) == 0:
-                Error(self, line, ErrorType.SYNTAX, f"Empty {self.tokenize_data['type'].value} value definition!").exit()
-            self.tokens.append(Token(self.tokenize_data["type"], line,
-                column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
-            self.tokenize_data.clear()
-            self.tokenize_mode = self.tokenize_mode_normal
-            return self.tokenize_mode(line, code, column, char)
-
-        # Check for value type definition
-        if len(self.tokenize_data["value"]) == 1 and self.tokenize_data["type"] == TokenType.DECIMAL:
-
-            # If the value type is decimal, add the char
-            if char in string.digits:
-                self.tokenize_data["value"] += char
-                return False
+        if char in string.digits:
+            return self.tokenize_value(line, code, column)
 
-            # Raise error, if the first char is not 0
-            if self.tokenize_data["value"] != "0":
-                Error(self, line, ErrorType.SYNTAX, "The first digit of a non-decimal value definition" +
-                      f" need to be 0, not {self.tokenize_data['value']!r}!").exit()
+        if char in ("'", '"'):
+            Error(self, line, ErrorType.SYNTAX,
+                  "String was not closed until the end of the line!").exit()
 
-            # If the type is valid, set it up, else, raise error
-            token_type = {"x": TokenType.HEXADECIMAL, "o": TokenType.OCTAL, "b": TokenType.BINARY}
-            if char.lower() not in token_type:
-                Error(self, line, ErrorType.SYNTAX,
-                    f"Invalid char {char!r} in decimal value definition!").exit()
-            self.tokenize_data["type"] = token_type[char.lower()]
-            self.tokenize_data["value"] = ""
-            return False
-
-        # Raise error, if the type don't support the char
-        if self.tokenize_data["type"] != TokenType.HEXADECIMAL:
-            allowed = {TokenType.DECIMAL: string.digits, TokenType.OCTAL: string.octdigits, TokenType.BINARY: "01"}
-            if char not in allowed[self.tokenize_data["type"]]:
+        if char == "%":
+            if code[column + 1] not in "ria":
                 Error(self, line, ErrorType.SYNTAX,
-                      f"Invalid char {char!r} in {self.tokenize_data['type'].value} value definition!").exit()
-
-        # Add the char
-        self.tokenize_data["value"] += char
+                    f"The first char of a argument definition must be 'r', 'i' or 'a', not {code[column + 1]!r}!").exit()
+            Error(self, line, ErrorType.SYNTAX,
+                f"The second char of a argument definition must be a digit, not {code[column + 2]!r}!").exit()
 
-        return False
+        Error(self, line, ErrorType.SYNTAX, f"Unknown char {char!r}! Hint: Names are only allowed to contain\n" +
+              f"the following characters and can't start with a digit:\n_{string.ascii_letters}{string.digits}").exit()
 
-    def tokenize_mode_name(self, line: int, code: str, column: int, char: str) -> bool:
-        """Tokenize a char in name mode"""
+    def tokenize_value(self, line: int, code: str, start: int) -> tuple[Token, int]:
+        """Tokenize a value char by char and return it with the column after it"""
 
-        # Check for the end of the name
-        if char not in string.ascii_letters + string.digits + "_.":
+        token_type = TokenType.DECIMAL
+        value = code[start]
 
-            # Check for keywords
-            keywords = {"include": TokenType.INCLUDE, "export": TokenType.EXPORT,
-                        "code": TokenType.CODE, "const": TokenType.CONSTANT,
-                        "var": TokenType.VARIABLE, "res": TokenType.RESOURCE}
-            if self.tokenize_data["value"].lower() in keywords:
-                self.tokens.append(Token(keywords[self.tokenize_data["value"].lower()], line,
-                    column - len(self.tokenize_data["value"])))
+        column = start + 1
+        for column in range(start + 1, len(code)):
 
-            # Check for registers
-            elif len(self.tokenize_data["value"]) == 1 and self.tokenize_data["value"].lower() in "abcdhlzf":
-                self.tokens.append(Token(TokenType.REGISTER, line, column - 1, self.tokenize_data["value"].lower()))
+            char = code[column]
 
-            # Normal name
-            else:
-                self.tokens.append(Token(TokenType.NAME, line,
-                    column - len(self.tokenize_data["value"]), self.tokenize_data["value"]))
+            # Ignore underscore char
+            if char == "_":
+                continue
 
-            self.tokenize_data.clear()
-            self.tokenize_mode = self.tokenize_mode_normal
-            return self.tokenize_mode(line, code, column, char)
+            # Check for value type definition after the first digit
+            if len(value) == 1 and token_type == TokenType.DECIMAL:
 
-        # Add the char
-        self.tokenize_data["value"] += char
+                if char in string.digits:
+                    value += char
+                    continue
 
-        return False
+                if char not in string.hexdigits + "xobXOB":
+                    break
 
-    def tokenize_mode_argument(self, line: int, code: str, column: int, char: str) -> bool:
-        """Tokenize a char in argument mode"""
+                # Raise error, if the first char is not 0
+                if value != "0":
+                    Error(self, line, ErrorType.SYNTAX, "The first digit of a non-decimal value definition" +
+                          f" need to be 0, not {value!r}!").exit()
+
+                # If the type is valid, set it up, else, raise error
+                if char.lower() not in PREFIXES:
+                    Error(self, line, ErrorType.SYNTAX,
+                        f"Invalid char {char!r} in decimal value definition!").exit()
+                token_type = PREFIXES[char.lower()]
+                value = ""
+                continue
 
-        # Check first char
-        if len(self.tokenize_data["value"]) == 0:
-            if char not in "ria":
-                Error(self, line, ErrorType.SYNTAX,
-                    f"The first char of a argument definition must be 'r', 'i' or 'a', not {char!r}!").exit()
+            # Check for the end of the value
+            if char not in string.hexdigits:
+                break
 
-        # Check second char
-        elif len(self.tokenize_data["value"]) == 1:
-            if char not in string.digits:
+            # Raise error, if the type don't support the char
+            if token_type != TokenType.HEXADECIMAL and char not in DIGITS[token_type]:
                 Error(self, line, ErrorType.SYNTAX,
-                    f"The second char of a argument definition must be a digit, not {char!r}!").exit()
+                      f"Invalid char {char!r} in {token_type.value} value definition!").exit()
 
-        # Add the argument
-        else:
-            self.tokens.append(Token(TokenType.ARGUMENT, line, column - 3, self.tokenize_data["value"]))
-            self.tokenize_data.clear()
-            self.tokenize_mode = self.tokenize_mode_normal
-            return self.tokenize_mode(line, code, column, char)
+            value += char
 
-        # Add the char
-        self.tokenize_data["value"] += char
+        if len(value) == 0:
+            Error(self, line, ErrorType.SYNTAX, f"Empty {token_type.value} value definition!").exit()
 
-        return False
+        return Token(token_type, line, column - len(value), value), column
 
-    def parse(self) -> None:
-        """Parse the tokens"""
+    def parse(self, token_lines: Iterable[range] | None = None) -> None:
+        """Parse the token lines, by default directly from the tokenizer"""
 
-        # Loop through each abstract line
-        for abstract in self.abstract_lines:
+        # Loop through each token line
+        for tokens in self.tokenize() if token_lines is None else token_lines:
 
-            # Handle line in mode and pass the token and abstract line
-            self.parse_mode(self.token_lines[abstract[0].line], abstract)
+            # Handle the abstract line in mode, if it is not empty
+            abstract = self.abstract(tokens)
+            if abstract:
+                self.parse_mode(abstract)
 
-    def parse_mode_definition(self, tokens: list[Token], abstract: list[Token]) -> None:
+    def parse_mode_definition(self, abstract: list[TokenView]) -> None:
         """Parse the tokens in definition section"""
 
         # Check for macro
         if "macro" in self.parse_data:
-            if self.parse_mode_macro(tokens, abstract):
+            if self.parse_mode_macro(abstract):
                 return
 
         # Define check information for the different keywords
@@ -399,7 +403,7 @@ class Module:
                       f"Invalid token '{abstract[0].type.value}'{value}\n" +
                       "at the beginning of the line in the definition section!").exit()
 
-    def parse_mode_macro(self, tokens: list[Token], abstract: list[Token]) -> None:
+    def parse_mode_macro(self, abstract: list[TokenView]) -> None:
         """Parse the tokens of a macro in the definition section"""
 
         # If the macro was created
@@ -463,7 +467,7 @@ class Module:
 
         return True
 
-    def parse_mode_code(self, tokens: list[Token], abstract: list[Token]) -> None:
+    def parse_mode_code(self, abstract: list[TokenView]) -> None:
         """Parse the tokens in the code section"""
 
         if abstract[0].type not in (TokenType.NAME, TokenType.AT):
@@ -519,8 +523,7 @@ class Module:
 
     @classmethod
     def file(cls, path: str, modules: dict[str, Self], main: bool = False) -> Self:
-        """Load a module from file"""
+        """Load a module from file, which is read while parsing"""
 
-        with open(path, "r", encoding="utf-8") as f:
-            return cls(f.read(), path, modules, main)
+        return cls(None, path, modules, main)
 
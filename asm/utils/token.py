@@ -1,6 +1,10 @@
 # Standard
+from __future__ import annotations
+from array import array
 from dataclasses import dataclass
 from enum import StrEnum, auto
+from typing import Iterable
+import sys
 
 
 class TokenType(StrEnum):
@@ -49,6 +53,131 @@ class Token:
         return f"{f'{self.line}:{self.column}':<7}{self.type.name:<12}{value}"
 
 
+# Token types by their code in a token store and the other way around
+TOKEN_TYPES: tuple[TokenType, ...] = tuple(TokenType)
+TOKEN_CODES: dict[TokenType, int] = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
+
+class TokenStore:
+    """Tokens stored in parallel arrays with their values in a table of interned strings
+
+    Every token is one entry in the type, line, column and value arrays. The value is the
+    index in the string table, where index 0 is no value. The string table holds every
+    value once and the strings themselves are interned, so names like registers and
+    mnemonics exist only once in the whole assembler. The parser and the error reporter
+    use views of single tokens, which are only created for the tokens they need.
+    """
+
+    __slots__ = ("types", "lines", "columns", "values", "strings", "string_codes")
+
+    def __init__(self) -> None:
+
+        self.types: array = array("B")
+        self.lines: array = array("I")
+        self.columns: array = array("I")
+        self.values: array = array("I")
+
+        self.strings: list[str | None] = [None]
+        self.string_codes: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> TokenView:
+        return TokenView(self, index)
+
+    def intern(self, value: str) -> int:
+        """Get the code of a value in the string table and add it, if it is new"""
+
+        code = self.string_codes.get(value)
+
+        if code is None:
+            code = self.string_codes[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+
+        return code
+
+    def append(self, token_type: TokenType, line: int, column: int, value: str | None = None) -> int:
+        """Add a token and return its index"""
+
+        self.types.append(TOKEN_CODES[token_type])
+        self.lines.append(line)
+        self.columns.append(column)
+        self.values.append(0 if value is None else self.intern(value))
+
+        return len(self.types) - 1
+
+    def views(self, indices: range) -> list[TokenView]:
+        return [TokenView(self, index) for index in indices]
+
+    def copy(self, other: TokenStore, indices: Iterable[int]) -> range:
+        """Copy tokens of another store to the end and return their indices"""
+
+        first = len(self.types)
+        strings, intern = other.strings, self.intern
+
+        for index in indices:
+            self.types.append(other.types[index])
+            self.lines.append(other.lines[index])
+            self.columns.append(other.columns[index])
+            code = other.values[index]
+            self.values.append(intern(strings[code]) if code else 0)
+
+        return range(first, len(self.types))
+
+    def clear(self, strings: bool = True) -> None:
+        """Remove all tokens and optionally the string table"""
+
+        del self.types[:], self.lines[:], self.columns[:], self.values[:]
+
+        if strings:
+            del self.strings[1:]
+            self.string_codes.clear()
+
+
+class TokenView:
+    """View of a token in a token store, which behaves like a token"""
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: TokenStore, index: int) -> None:
+        self.store: TokenStore = store
+        self.index: int = index
+
+    @property
+    def type(self) -> TokenType:
+        return TOKEN_TYPES[self.store.types[self.index]]
+
+    @property
+    def line(self) -> int:
+        return self.store.lines[self.index]
+
+    @property
+    def column(self) -> int:
+        return self.store.columns[self.index]
+
+    @property
+    def value(self) -> str | None:
+        return self.store.strings[self.store.values[self.index]]
+
+    def token(self) -> Token:
+        return Token(self.type, self.line, self.column, self.value)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (Token, TokenView)):
+            return NotImplemented
+        return (self.type, self.line, self.column, self.value) == (other.type, other.line, other.column, other.value)
+
+    def __hash__(self) -> int:
+        return hash((self.type, self.line, self.column, self.value))
+
+    def __repr__(self):
+        return repr(self.token())
+
+    def __str__(self):
+        return str(self.token())
+
+
 def token_list_type(token_list: list[Token]) -> list[TokenType]:
     """Get a list with the types of the tokens in the list"""
     return [token.type for token in token_list]
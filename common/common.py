@@ -1,3 +1,8 @@
+# Standard modules
+from dataclasses import dataclass
+from types import MappingProxyType
+
+
 REGISTER = [
     ("a", "000"),
     ("b", "001"),
@@ -14,14 +19,14 @@ INSTRUCTION = [
     ("mvi",    "00000", ("r", "i"), 2),
     ("mvr",    "00001", ("r", "r"), 2),
     ("lda",    "00010", ("r", "a"), 3),
-    ("ldhl",   "00011", ("r"),      1),
+    ("ldhl",   "00011", ("r",),     1),
     ("sta",    "00100", ("r", "a"), 3),
-    ("sthl",   "00101", ("r"),      1),
-    ("pushi",  "00110", ("i"),      2),
-    ("pushr",  "00111", ("r"),      1),
-    ("pop",    "01000", ("r"),      1),
+    ("sthl",   "00101", ("r",),     1),
+    ("pushi",  "00110", ("i",),     2),
+    ("pushr",  "00111", ("r",),     1),
+    ("pop",    "01000", ("r",),     1),
     ("nop",    "01001", (),         1),
-    ("jnz",    "01010", ("r"),      1),
+    ("jnz",    "01010", ("r",),     1),
     ("jmp",    "01011", (),         1),
     ("ini",    "01100", ("r", "i"), 2),
     ("inr",    "01101", ("r", "r"), 2),
@@ -41,8 +46,8 @@ INSTRUCTION = [
     ("cmpr",   "11011", ("r", "r"), 2),
     ("sbbi",   "11100", ("r", "i"), 2),
     ("sbbr",   "11101", ("r", "r"), 2),
-    ("shl",    "11110", ("r"),      1),
-    ("shr",    "11111", ("r"),      1),
+    ("shl",    "11110", ("r",),     1),
+    ("shr",    "11111", ("r",),     1),
 ]
 
 
@@ -63,12 +68,26 @@ ADDR_PC = 0xFFFE
 
 BANK_RAM = 0
 BANK_VRAM = 1
+BANK_COUNT = 256
 
 
 PORT_EXIT = 0
 PORT_GPU = 1
 
 
+GPU_CLEAR = 0
+GPU_FILL = 1
+GPU_BLIT = 2
+GPU_SCROLL = 3
+GPU_LINE = 4
+
+GPU_ARGS = (1, 5, 6, 2, 5)  # Argument bytes of each command
+
+GPU_OFF = 0
+GPU_ON = 1
+GPU_INVERT = 2
+
+
 EXIT_CLEAN = 0
 EXIT_UNKNOWN = 1
 EXIT_ST_OVERFLOW = 2
@@ -78,6 +97,45 @@ EXIT_INVALID_BANK = 5
 EXIT_INVALID_ADDR = 6
 
 
+FLAG_LESS = 0b0001
+FLAG_EQUAL = 0b0010
+FLAG_CARRY = 0b0100
+FLAG_BORROW = 0b1000
+
+
+@dataclass(frozen=True, slots=True)
+class Opcode:
+    """Metadata of an instruction type
+
+    The flags are the FLAG_* bits, which the instruction can set. An instruction with
+    flags replaces the whole flags register (marked with '^' in the spec).
+    """
+
+    code: int
+    name: str
+    args: tuple[str, ...]
+    length: int
+    cycles: int
+    flags: int
+
+
+INSTRUCTION_FLAGS = {
+    "addi": FLAG_CARRY, "addr": FLAG_CARRY, "adci": FLAG_CARRY, "adcr": FLAG_CARRY,
+    "cmpi": FLAG_LESS | FLAG_EQUAL, "cmpr": FLAG_LESS | FLAG_EQUAL,
+    "sbbi": FLAG_BORROW, "sbbr": FLAG_BORROW,
+    "shl": FLAG_CARRY, "shr": FLAG_CARRY,
+}
+
+# Opcode metadata by opcode (first instruction byte >> 3) and by name, every cycle takes one byte
+OPCODES = tuple(Opcode(int(b, 2), n, a, l, l, INSTRUCTION_FLAGS.get(n, 0)) for n, b, a, l in INSTRUCTION)
+OPCODE = MappingProxyType({opcode.name: opcode for opcode in OPCODES})
+
+REGISTER_NAME = tuple(n for n, b in REGISTER)
+REGISTER_CODE = MappingProxyType({n: int(b, 2) for n, b in REGISTER})
+
+MAX_CYCLES = max(opcode.cycles for opcode in OPCODES)
+
+
 def number2str(number: int, size: int = 0) -> str:
     return hex(number).replace('0x', '').zfill(size)
 
@@ -91,38 +149,63 @@ def split16(number: int) -> tuple[int, int]:
     return str2number(string[:2]), str2number(string[2:])
 
 
-def instruction2binary(name: str) -> str:
-    for n, b, a, l in INSTRUCTION:
-        if n == name:
-            return b
+def instruction2binary(name: str) -> str | None:
+    opcode = OPCODE.get(name)
+    return format(opcode.code, "05b") if opcode is not None else None
+
+
+def binary2instruction(binary: str) -> str | None:
+    return OPCODES[int(binary, 2)].name if len(binary) == 5 else None
+
+
+def instruction_args(name: str) -> tuple[str, ...] | None:
+    opcode = OPCODE.get(name)
+    return opcode.args if opcode is not None else None
+
+
+def instruction_length(name: str) -> int | None:
+    opcode = OPCODE.get(name)
+    return opcode.length if opcode is not None else None
+
+
+def register2binary(name: str) -> str | None:
+    code = REGISTER_CODE.get(name)
+    return format(code, "03b") if code is not None else None
+
+
+def binary2register(binary: str) -> str | None:
+    return REGISTER_NAME[int(binary, 2)] if len(binary) == 3 else None
 
 
-def binary2instruction(binary: str) -> str:
-    for n, b, a, l in INSTRUCTION:
-        if b == binary:
-            return n
+def disassemble(data: bytes) -> list[tuple[int, str]]:
+    """Decode machine code into pairs of address and assembly line"""
 
+    lines = []
+    pc = 0
 
-def instruction_args(name: str) -> str:
-    for n, b, a, l in INSTRUCTION:
-        if n == name:
-            return a
+    while pc < len(data):
 
+        opcode = OPCODES[data[pc] >> 3]
 
-def instruction_length(name: str) -> str:
-    for n, b, a, l in INSTRUCTION:
-        if n == name:
-            return l
+        if pc + opcode.length > len(data):
+            lines.append((pc, "; " + " ".join(f"0x{byte:02X}" for byte in data[pc:])))
+            break
 
+        operands = data[pc + 1:pc + opcode.length]
+        args = []
 
-def register2binary(name: str) -> str:
-    for n, b in REGISTER:
-        if n == name:
-            return b
+        for i, kind in enumerate(opcode.args):
+            if kind == "r" and i == 0:
+                args.append(REGISTER_NAME[data[pc] & 0b111])
+            elif kind == "r":
+                args.append(REGISTER_NAME[operands[0] & 0b111])
+            elif kind == "i":
+                args.append(f"0x{operands[0]:02X}")
+            else:
+                args.append(f"0x{operands[0] << 8 | operands[1]:04X}")
 
+        lines.append((pc, f"{opcode.name:<8}{', '.join(args)}".rstrip()))
+        pc += opcode.length
 
-def binary2register(binary: str) -> str:
-    for n, b in REGISTER:
-        if b == binary:
-            return n
+    return lines
 
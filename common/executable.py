@@ -0,0 +1,169 @@
+# Standard modules
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Self
+import struct
+import sys
+import os
+
+# Local modules
+from common import *
+
+
+MAGIC = b"N1B\0"
+VERSION = 1
+
+# Magic, version, padding, ROM length, entry point, resource offset, debug offset
+HEADER = struct.Struct(">4sBxHHII")
+
+
+@dataclass(frozen=True, slots=True)
+class Header:
+    """Header of a binary executable (.n1b)
+
+    The ROM follows directly after the header. The resource offset is the ROM address
+    of the first resource and the debug offset is the file offset of the debug section,
+    which runs until the end of the file. Both are 0, if the section doesn't exist.
+    """
+
+    rom_length: int
+    entry: int = ADDR_ROM
+    resource_offset: int = 0
+    debug_offset: int = 0
+    version: int = VERSION
+
+    def pack(self) -> bytes:
+        return HEADER.pack(MAGIC, self.version, self.rom_length, self.entry, self.resource_offset, self.debug_offset)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Self:
+
+        if len(data) < HEADER.size:
+            raise ValueError("Invalid executable! The file is too short for a header.")
+
+        magic, version, rom_length, entry, resource_offset, debug_offset = HEADER.unpack_from(data)
+
+        if magic != MAGIC:
+            raise ValueError("Invalid executable! Wrong magic number.")
+        if version != VERSION:
+            raise ValueError(f"Invalid executable! Unsupported version {version}.")
+        if rom_length > SIZE_ROM:
+            raise ValueError("Invalid executable! The ROM is too large.")
+        if HEADER.size + rom_length > len(data):
+            raise ValueError("Invalid executable! The file is too short for its ROM.")
+        if not ADDR_ROM <= entry < ADDR_ROM + max(rom_length, 1):
+            raise ValueError("Invalid executable! The entry point is outside of the ROM.")
+
+        return cls(rom_length, entry, resource_offset, debug_offset, version)
+
+
+def text2rom(text: str) -> bytes:
+    """Convert the 0s and 1s of a text executable (.n1) to the bytes of its ROM"""
+
+    text = "".join(text.split())
+
+    if text.strip("01"):
+        raise ValueError("Invalid executable! The file may only contain 0s and 1s.")
+    if len(text) % 8:
+        raise ValueError("Invalid executable! The number of bits isn't a multiple of 8.")
+
+    return int(text, 2).to_bytes(len(text) // 8, "big") if text else b""
+
+
+def text2executable(text: str, entry: int = ADDR_ROM, resource_offset: int = 0, debug: bytes = b"") -> bytes:
+    """Convert a text executable (.n1) with 0s and 1s to a binary executable (.n1b)"""
+
+    rom = text2rom(text)
+
+    debug_offset = HEADER.size + len(rom) if debug else 0
+
+    return Header(len(rom), entry, resource_offset, debug_offset).pack() + rom + debug
+
+
+def executable2text(data: bytes) -> str:
+    """Convert a binary executable (.n1b) to a text executable (.n1) with 0s and 1s"""
+
+    header = Header.unpack(data)
+    rom = data[HEADER.size:HEADER.size + header.rom_length]
+
+    return "".join(format(byte, "08b") for byte in rom)
+
+
+def print_help() -> None:
+    """Print a help message"""
+
+    print("------------------------------")
+    print("N1 TOOLCHAIN - EXECUTABLE CONV")
+    print("------------------------------")
+    print()
+    print("--- Usage ---")
+    print()
+    print("python executable.py [-h/--help] [-o] path")
+    print()
+    print("-h/--help     Show this help message")
+    print("-o            Overwrite the output file")
+    print()
+    print("path          File path of .n1 or .n1b file to convert")
+    print()
+
+
+def main(args: list[str]) -> int:
+    """Main function of the executable converter"""
+
+    if "-h" in args or "--help" in args:
+        print_help()
+        return 0
+
+    override = "-o" in args
+
+    args = [arg for arg in args if arg != "-o"]
+
+    if len(args) < 2:
+        print("Missing file argument! Add '-h' or '--help' for help ...")
+        return 1
+
+    path = os.path.abspath(args[-1])
+
+    if not os.path.isfile(path):
+        print("Invalid file path! File don't exists. Add '-h' or '--help' for help ...")
+        return 1
+
+    name, extension = os.path.splitext(path)
+
+    if extension not in (".n1", ".n1b"):
+        print("Invalid file type! File extension needs to be '.n1' or '.n1b'. Add '-h' or '--help' for help ...")
+        return 1
+
+    output = name + (".n1b" if extension == ".n1" else ".n1")
+
+    if os.path.exists(output) and not override:
+        print(f"The file '{output}' already exists. Use '-o' to overwrite it ...")
+        return 1
+
+    if extension == ".n1":
+        with open(path, "r") as f:
+            try:
+                data = text2executable(f.read())
+            except ValueError as e:
+                print(e)
+                return 1
+        with open(output, "wb") as f:
+            f.write(data)
+    else:
+        with open(path, "rb") as f:
+            try:
+                text = executable2text(f.read())
+            except ValueError as e:
+                print(e)
+                return 1
+        with open(output, "w") as f:
+            f.write(text)
+
+    print(f"Converted '{path}' to '{output}'")
+
+    return 0
+
+
+# Main
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+# Standard modules
+from array import array
+
+# Local modules
+from common import *
+
+
+# Shifts of the carry and borrow flag bits to get the carry/borrow input of a table index
+CARRY_SHIFT = FLAG_CARRY.bit_length() - 1
+BORROW_SHIFT = FLAG_BORROW.bit_length() - 1
+
+
+def build_add() -> array:
+    """Build the table for ADD/ADC indexed by a << 9 | b << 1 | carry with the entries result | flags << 8"""
+
+    table = array("H", bytes(0x40000))
+
+    for a in range(256):
+        for b in range(256):
+            for carry in (0, 1):
+                result = a + b + carry
+                table[a << 9 | b << 1 | carry] = result & 0xFF | (FLAG_CARRY if result > 0xFF else 0) << 8
+
+    return table
+
+
+def build_sbb() -> array:
+    """Build the table for SBB indexed by a << 9 | b << 1 | borrow with the entries result | flags << 8"""
+
+    table = array("H", bytes(0x40000))
+
+    for a in range(256):
+        for b in range(256):
+            for borrow in (0, 1):
+                result = a - b - borrow
+                table[a << 9 | b << 1 | borrow] = result & 0xFF | (FLAG_BORROW if result < 0 else 0) << 8
+
+    return table
+
+
+def build_cmp() -> bytes:
+    """Build the table for CMP indexed by a << 8 | b with the flags as entries"""
+
+    return bytes((FLAG_LESS if a < b else 0) | (FLAG_EQUAL if a == b else 0) for a in range(256) for b in range(256))
+
+
+def build_shift(left: bool) -> array:
+    """Build the table for SHL/SHR indexed by a with the entries result | flags << 8"""
+
+    table = array("H", bytes(0x200))
+
+    for a in range(256):
+        if left:
+            table[a] = a << 1 & 0xFF | (FLAG_CARRY if a & 0x80 else 0) << 8
+        else:
+            table[a] = a >> 1 | (FLAG_CARRY if a & 0x01 else 0) << 8
+
+    return table
+
+
+ADD = build_add()
+SBB = build_sbb()
+CMP = build_cmp()
+SHL = build_shift(True)
+SHR = build_shift(False)
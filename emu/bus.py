@@ -0,0 +1,193 @@
+# Standard modules
+from __future__ import annotations
+from collections import deque
+from typing import Callable, TYPE_CHECKING
+import threading as th
+
+# Local modules
+from constants import *
+from common import *
+
+if TYPE_CHECKING:
+    from n1 import N1
+
+
+class Device:
+    """Device on the I/O bus, which reads and writes single bytes on its ports
+
+    Writes to a buffered device are queued by the bus and passed to write_batch() in
+    batches by the flush thread, so they can't slow down the instruction loop. The batches
+    run outside the CPU thread, so a buffered device must only change its own state and
+    never the machine (registers, PC, SP, exit, bank selection, memory). Devices, which
+    change the machine like the exit device and the GPU, are not buffered.
+    """
+
+    buffered: bool = False
+
+    def read(self, port: int) -> int:
+        return 0
+
+    def write(self, port: int, value: int) -> None:
+        pass
+
+    def write_batch(self, writes: list[tuple[int, int]]) -> None:
+
+        for port, value in writes:
+            self.write(port, value)
+
+    def reset(self) -> None:
+        """Clear the state of the device, when the machine is reset"""
+        pass
+
+    def save_state(self) -> object:
+        """Get the state of the device for a snapshot"""
+        return None
+
+    def load_state(self, state: object) -> None:
+        """Restore the state of the device from a snapshot"""
+        pass
+
+
+class Exit(Device):
+    """Exit device, which stops the machine with the written exit code"""
+
+    def __init__(self, n1: N1) -> None:
+        self.n1: N1 = n1
+
+    def write(self, port: int, value: int) -> None:
+        self.n1.exit = value
+
+
+class Bus:
+    """I/O bus with one read and one write handler per port
+
+    Unconnected ports read 0 and ignore writes. The exit device is connected to PORT_EXIT.
+    """
+
+    def __init__(self, n1: N1) -> None:
+
+        self.n1: N1 = n1
+
+        self.devices: dict[int, Device] = {}
+        self.readers: list[Callable[[int], int]] = [self.unconnected_read] * 256
+        self.writers: list[Callable[[int, int], None]] = [self.unconnected_write] * 256
+
+        self.queues: dict[Device, deque[tuple[int, int]]] = {}
+        self.lock: th.Lock = th.Lock()
+        self.thread: th.Thread | None = None
+        self.stopping: th.Event = th.Event()
+
+        self.connect(PORT_EXIT, Exit(n1))
+
+    def connect(self, port: int, device: Device) -> None:
+        """Connect a device to a port and replace the previous device"""
+
+        self.disconnect(port)
+
+        self.devices[port] = device
+        self.readers[port] = device.read
+
+        if device.buffered:
+            queue = self.queues.setdefault(device, deque())
+            self.writers[port] = lambda port, value: queue.append((port, value))
+        else:
+            self.writers[port] = device.write
+
+    def disconnect(self, port: int) -> Device | None:
+        """Disconnect the device of a port and flush its queued writes"""
+
+        device = self.devices.pop(port, None)
+
+        if device is None:
+            return None
+
+        self.readers[port] = self.unconnected_read
+        self.writers[port] = self.unconnected_write
+
+        if device.buffered and device not in self.devices.values():
+            self.flush_device(device)
+            del self.queues[device]
+
+        return device
+
+    def reset(self) -> None:
+        """Drop the queued writes and reset all devices"""
+
+        with self.lock:
+            for queue in self.queues.values():
+                queue.clear()
+
+        for device in set(self.devices.values()):
+            device.reset()
+
+    def save_state(self) -> dict[int, object]:
+        """Flush the queued writes and get the state of the device of every port"""
+
+        self.flush()
+
+        return {port: device.save_state() for port, device in self.devices.items()}
+
+    def load_state(self, states: dict[int, object]) -> None:
+        """Drop the queued writes and restore the state of the devices, which are still connected"""
+
+        with self.lock:
+            for queue in self.queues.values():
+                queue.clear()
+
+        for port, state in states.items():
+            if port in self.devices:
+                self.devices[port].load_state(state)
+
+    def read(self, port: int) -> int:
+        return self.readers[port](port)
+
+    def write(self, port: int, value: int) -> None:
+        self.writers[port](port, value)
+
+    def unconnected_read(self, port: int) -> int:
+        return 0
+
+    def unconnected_write(self, port: int, value: int) -> None:
+        pass
+
+    def flush(self) -> None:
+        """Pass the queued writes of all buffered devices to them"""
+
+        for device in list(self.queues):
+            self.flush_device(device)
+
+    def flush_device(self, device: Device) -> None:
+
+        queue = self.queues.get(device)
+        if not queue:
+            return
+
+        with self.lock:
+            writes = [queue.popleft() for _ in range(len(queue))]
+            device.write_batch(writes)
+
+    def start(self, interval: float = 1 / W_FPS) -> None:
+        """Start a thread, which flushes the buffered devices in the given interval"""
+
+        if self.thread is not None:
+            return
+
+        self.stopping.clear()
+        self.thread = th.Thread(target=self.run, args=(interval,), name="Bus", daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        """Stop and join the flush thread and flush the remaining writes"""
+
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+
+    def run(self, interval: float) -> None:
+
+        while not self.stopping.is_set():
+            self.flush()
+            self.stopping.wait(interval)
@@ -1,10 +1,14 @@
 # Window
 W_WIDTH = 1000
 W_HEIGHT = 700
+W_FPS = 30
 
 # Display
 D_WIDTH = 96
 D_HEIGHT = 64
+D_ROW = D_WIDTH // 8  # VRAM bytes per row (1 bit per lamp, most significant bit left)
+D_SIZE = D_ROW * D_HEIGHT
+D_FULL_REDRAW = 64  # Changed VRAM bytes, from which on the whole display is redrawn
 
 # Pixel
 P_WIDTH = 8
@@ -0,0 +1,105 @@
+# Standard modules
+from __future__ import annotations
+from dataclasses import dataclass
+import threading as th
+import time
+
+# Local modules
+from constants import *
+from common import *
+from n1 import N1
+from translate import Translator
+from debugger import BREAK
+
+
+# Maximum number of instructions between two checks of the clock
+CHUNK = 0x1000
+
+
+@dataclass(frozen=True, slots=True)
+class State:
+    """Consistent snapshot of the machine state for rendering"""
+
+    registers: bytes
+    pc: int
+    sp: int
+    mb: int
+    exit: int
+    cycles: int
+    vram: bytes
+
+    @classmethod
+    def capture(cls, n1: N1) -> State:
+        return cls(bytes(n1.registers), n1.pc, n1.sp, n1.mb, n1.exit, n1.cycles,
+                   bytes(n1.bank_view(BANK_VRAM)[:D_SIZE]))
+
+
+class CPU(th.Thread):
+    """Thread, which drives the machine with a target frequency in Hz (0 = unthrottled turbo)
+
+    Once per frame a new immutable state is published. The two buffers are swapped by
+    replacing the reference, so the renderer never sees a torn state and the CPU never
+    waits for the renderer. While the debugger stopped the machine, the thread waits and
+    executes the single steps requested by the window.
+    """
+
+    def __init__(self, glob: Global) -> None:
+
+        th.Thread.__init__(self, name="CPU", daemon=True)
+
+        self.glob: Global = glob
+
+        self.frequency: int = glob.frequency
+        self.state: State = State.capture(glob.n1)
+
+        self.steps: int = 0
+
+        self.running = True
+
+    def run(self) -> None:
+
+        n1 = self.glob.n1
+        debugger = self.glob.debugger
+
+        step = n1.step
+        if self.glob.translate:
+            translator = Translator(n1)
+            debugger.use_translator(translator)
+            step = translator.run
+
+        n1.bus.start()
+
+        interval = 1 / W_FPS
+        start = time.perf_counter()
+        cycles = n1.cycles
+        frame = start + interval
+
+        while self.running and n1.exit in (-1, BREAK):
+
+            if n1.exit == BREAK:
+                if self.steps:
+                    self.steps -= 1
+                    debugger.step()
+                else:
+                    time.sleep(interval)
+                self.state = State.capture(n1)
+                start = time.perf_counter()
+                cycles = n1.cycles
+                continue
+
+            if self.frequency:
+                budget = int((time.perf_counter() - start) * self.frequency) - (n1.cycles - cycles)
+                if budget > 0:
+                    step(min(CHUNK, max(1, budget // MAX_CYCLES)))
+                else:
+                    time.sleep(max(0.0, frame - time.perf_counter()))
+            else:
+                step(CHUNK)
+
+            now = time.perf_counter()
+            if now >= frame:
+                self.state = State.capture(n1)
+                frame = now + interval
+
+        n1.bus.close()
+        self.state = State.capture(n1)
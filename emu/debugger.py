@@ -0,0 +1,335 @@
+# Standard modules
+from dataclasses import dataclass
+from typing import Callable
+import operator
+
+# Local modules
+from constants import *
+from common import *
+from n1 import N1
+from translate import Translator
+
+
+# Exit value of a machine stopped by the debugger, which ends all run loops like a real exit
+BREAK = -2
+
+# Comparisons of register conditions
+CONDITIONS = {"==": operator.eq, "!=": operator.ne, "<=": operator.le, ">=": operator.ge,
+              "<": operator.lt, ">": operator.gt}
+
+# Address ranges and banks of the named watchpoint regions
+REGIONS = {"ram": (ADDR_RAM, ADDR_RAM + SIZE_RAM, None),
+           "vram": (ADDR_BANK, ADDR_BANK + D_SIZE, BANK_VRAM),
+           "bank": (ADDR_BANK, ADDR_BANK + SIZE_BANK, None)}
+
+
+def parse_condition(text: str) -> Callable[[bytearray], bool]:
+    """Parse a register condition like 'a==5' or 'c<0x10'"""
+
+    for symbol, compare in CONDITIONS.items():
+        register, found, value = text.partition(symbol)
+        if found:
+            break
+    else:
+        raise ValueError(f"Invalid condition '{text}'! Expected register, comparison and value like 'a==5'.")
+
+    register = register.strip().lower()
+    if register not in REGISTER_CODE:
+        raise ValueError(f"Invalid register '{register}' in condition!")
+
+    code, value = REGISTER_CODE[register], int(value, 0)
+
+    return lambda registers: compare(registers[code], value)
+
+
+@dataclass(frozen=True, slots=True)
+class Watchpoint:
+    """Memory range [start, end), which stops the machine after a write (bank None = any bank)"""
+
+    start: int
+    end: int
+    bank: int | None = None
+
+    def pages(self) -> range:
+        return range(self.start >> 8, (self.end - 1 >> 8) + 1)
+
+
+class Debugger:
+    """Breakpoints and watchpoints, which are swapped into the tables of the machine
+
+    A breakpoint wraps the dispatch entries of the instruction at its address, so only
+    instructions with the same first byte check the address. A watchpoint wraps the page
+    write entries of its range. The live tables of the machine are wrapped, so tables
+    swapped in by a profiler or tracer are kept. Without any breakpoints or watchpoints,
+    the wrapped tables are used again. The machine is stopped by setting its exit to
+    BREAK and continues with resume().
+    """
+
+    def __init__(self, n1: N1) -> None:
+
+        self.n1: N1 = n1
+
+        self.breakpoints: dict[int, Callable[[bytearray], bool] | None] = {}
+        self.watchpoints: list[Watchpoint] = []
+
+        self.reason: str = ""
+        self.skip: int | None = None
+        self.break_pc: int | None = None
+
+        # Wrapped tables and the tables installed into the machine
+        self.dispatch: list[Callable[[], int]] = n1.dispatch
+        self.page_set: list[Callable[[int, int], None]] = n1.page_set
+        self.installed_dispatch: list[Callable[[], int]] = n1.dispatch
+        self.installed_page_set: list[Callable[[int, int], None]] = n1.page_set
+
+        self.translator: Translator | None = None
+
+    def use_translator(self, translator: Translator) -> None:
+        """Split the blocks of a translator at the breakpoints"""
+
+        self.translator = translator
+        self.update()
+
+    @property
+    def stopped(self) -> bool:
+        return self.n1.exit == BREAK
+
+    def add_breakpoint(self, addr: int, condition: Callable[[bytearray], bool] | None = None) -> None:
+        """Stop before the instruction at an address, if the condition on the registers is true"""
+
+        self.breakpoints[addr] = condition
+        self.update()
+
+    def remove_breakpoint(self, addr: int) -> None:
+
+        self.breakpoints.pop(addr, None)
+        self.update()
+
+    def toggle_breakpoint(self, addr: int) -> bool:
+        """Add or remove a breakpoint and return if it exists now"""
+
+        if addr in self.breakpoints:
+            self.remove_breakpoint(addr)
+            return False
+
+        self.add_breakpoint(addr)
+        return True
+
+    def add_watchpoint(self, start: int, end: int | None = None, bank: int | None = None) -> Watchpoint:
+        """Stop after a write to the range [start, end), optionally only to one bank"""
+
+        watchpoint = Watchpoint(start, end if end is not None else start + 1, bank)
+
+        self.watchpoints.append(watchpoint)
+        self.update()
+
+        return watchpoint
+
+    def remove_watchpoint(self, watchpoint: Watchpoint) -> None:
+
+        if watchpoint in self.watchpoints:
+            self.watchpoints.remove(watchpoint)
+        self.update()
+
+    def clear(self) -> None:
+
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self.update()
+
+    def stop(self, reason: str) -> None:
+        """Stop the machine before the next instruction"""
+
+        if self.n1.exit in (-1, BREAK):
+            self.n1.exit = BREAK
+            self.reason = reason
+            self.break_pc = None
+
+    def pause(self) -> None:
+        self.stop("pause")
+
+    def resume(self) -> None:
+        """Continue a stopped machine without stopping again at the breakpoint, which stopped it"""
+
+        if not self.stopped:
+            return
+
+        self.skip = self.n1.pc if self.break_pc == self.n1.pc else None
+        self.break_pc = None
+        self.reason = ""
+        self.n1.exit = -1
+
+    def step(self) -> int:
+        """Execute a single instruction of a stopped machine, even at a breakpoint, and stop again"""
+
+        if not self.stopped:
+            return 0
+
+        self.resume()
+        self.skip = self.n1.pc
+        executed = self.n1.step()
+
+        if self.n1.exit == -1:
+            self.stop("step")
+
+        return executed
+
+    def command(self, text: str) -> str:
+        """Execute a debugger command of the window and return a short message
+
+        b ADDR [COND]                   Add a breakpoint with an optional condition like 'a==5'
+        rb ADDR                         Remove a breakpoint
+        w START [END] [BANK]            Add a watchpoint on an address range, optionally in one bank
+        w ram|vram [START END]          Add a watchpoint on (a range of) the RAM or VRAM
+        w bank N [START END]            Add a watchpoint on (a range of) a bank
+        rw                              Remove all watchpoints
+        c                               Remove all breakpoints and watchpoints
+        """
+
+        words = text.split()
+
+        if not words:
+            raise ValueError("Empty command!")
+
+        name, args = words[0].lower(), words[1:]
+
+        if name == "b" and 1 <= len(args):
+            addr = int(args[0], 0) & 0xFFFF
+            condition = parse_condition("".join(args[1:])) if len(args) > 1 else None
+            self.add_breakpoint(addr, condition)
+            return f"break 0x{addr:04X}" + (" if " + "".join(args[1:]) if condition else "")
+
+        if name == "rb" and len(args) == 1:
+            addr = int(args[0], 0) & 0xFFFF
+            self.remove_breakpoint(addr)
+            return f"removed 0x{addr:04X}"
+
+        if name == "w" and args:
+            watchpoint = self.add_watchpoint(*self.parse_range(args))
+            bank = "" if watchpoint.bank is None else f" bank {watchpoint.bank}"
+            return f"watch 0x{watchpoint.start:04X}-0x{watchpoint.end - 1:04X}" + bank
+
+        if name == "rw" and not args:
+            for watchpoint in list(self.watchpoints):
+                self.remove_watchpoint(watchpoint)
+            return "removed watchpoints"
+
+        if name == "c" and not args:
+            self.clear()
+            return "cleared"
+
+        raise ValueError(f"Invalid command '{text}'!")
+
+    @staticmethod
+    def parse_range(args: list[str]) -> tuple[int, int, int | None]:
+        """Parse the address range and bank of a watchpoint command"""
+
+        region = args[0].lower()
+
+        if region in REGIONS:
+            start, end, bank = REGIONS[region]
+            if region == "bank":
+                if len(args) < 2:
+                    raise ValueError("Missing bank number!")
+                bank = int(args[1], 0)
+                args = args[1:]
+            if not 0 <= (bank or 0) < BANK_COUNT:
+                raise ValueError(f"Invalid bank {bank}!")
+            if len(args) == 3:
+                start, end = max(start, int(args[1], 0)), min(end, int(args[2], 0) + 1)
+            elif len(args) != 1:
+                raise ValueError("Expected the whole region or a start and end address!")
+        else:
+            start = int(args[0], 0)
+            end = int(args[1], 0) + 1 if len(args) > 1 else start + 1
+            bank = int(args[2], 0) if len(args) > 2 else None
+            if len(args) > 3:
+                raise ValueError("Too many arguments!")
+
+        if not 0 <= start < end <= 0x10000:
+            raise ValueError("Invalid address range!")
+
+        return start, end, bank
+
+    def update(self) -> None:
+        """Rebuild the tables of the machine by wrapping the live tables
+
+        Tables swapped into the machine by others since the last update become the new
+        wrapped tables, else the previously wrapped tables are wrapped again.
+        """
+
+        n1 = self.n1
+
+        if n1.dispatch is not self.installed_dispatch:
+            self.dispatch = n1.dispatch
+        if n1.page_set is not self.installed_page_set:
+            self.page_set = n1.page_set
+
+        dispatch = self.dispatch
+        if self.breakpoints:
+            dispatch = list(dispatch)
+            for byte in self.break_bytes():
+                dispatch[byte] = self.breaking(self.dispatch[byte])
+
+        page_set = self.page_set
+        if self.watchpoints:
+            page_set = list(page_set)
+            for page in {page for watchpoint in self.watchpoints for page in watchpoint.pages()}:
+                watchpoints = [watchpoint for watchpoint in self.watchpoints if page in watchpoint.pages()]
+                page_set[page] = self.watching(self.page_set[page], watchpoints)
+
+        n1.dispatch = self.installed_dispatch = dispatch
+        n1.page_set = self.installed_page_set = page_set
+
+        if self.translator is not None:
+            self.translator.breakpoints = frozenset(self.breakpoints)
+
+    def break_bytes(self) -> set[int]:
+        """Get the first instruction bytes, which can be executed at a breakpoint"""
+
+        n1 = self.n1
+        rom_end = ADDR_ROM + len(n1.rom)
+
+        # Code outside of the ROM can change, so every instruction needs to check the address
+        if any(not ADDR_ROM <= addr < rom_end for addr in self.breakpoints):
+            return set(range(256))
+
+        return {n1.peek(addr) for addr in self.breakpoints}
+
+    def breaking(self, handler: Callable[[], int]) -> Callable[[], int]:
+
+        n1 = self.n1
+        breakpoints = self.breakpoints
+
+        def run() -> int:
+
+            pc = n1.pc
+
+            if pc in breakpoints and pc != self.skip:
+                condition = breakpoints[pc]
+                if condition is None or condition(n1.registers):
+                    self.stop(f"break 0x{pc:04X}")
+                    self.break_pc = pc
+                    n1.aborted = True
+                    return 0
+
+            # The skip is cleared afterwards, so breakpoints wrapped twice are skipped as well
+            used = handler()
+            self.skip = None
+            return used
+
+        return run
+
+    def watching(self, set_: Callable[[int, int], None], watchpoints: list[Watchpoint]) -> Callable[[int, int], None]:
+
+        n1 = self.n1
+
+        def watched(addr: int, value: int) -> None:
+
+            set_(addr, value)
+
+            for watchpoint in watchpoints:
+                if watchpoint.start <= addr < watchpoint.end and watchpoint.bank in (None, n1.mb):
+                    self.stop(f"watch 0x{addr:04X}")
+
+        return watched
@@ -0,0 +1,212 @@
+# Standard modules
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+# External libraries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Local modules
+from constants import *
+from common import *
+from bus import Device
+
+if TYPE_CHECKING:
+    from n1 import N1
+
+
+def signed(value: int) -> int:
+    return value - 0x100 if value & 0x80 else value
+
+
+def line_points(x0: int, y0: int, x1: int, y1: int) -> list[tuple[int, int]]:
+    """Get the points of a line with one point per step along the longer axis"""
+
+    n = max(abs(x1 - x0), abs(y1 - y0))
+
+    if n == 0:
+        return [(x0, y0)]
+
+    return [(x0 + round((x1 - x0) * i / n), y0 + round((y1 - y0) * i / n)) for i in range(n + 1)]
+
+
+class GPU(Device):
+    """GPU device, which draws into the VRAM bank
+
+    A command is the command byte followed by its argument bytes (see GPU_ARGS), written
+    one by one to the GPU port. It is executed after the last argument byte:
+
+    GPU_CLEAR   color                   Set all lamps
+    GPU_FILL    x, y, w, h, color       Set the lamps of a rectangle
+    GPU_BLIT    addr hi/lo, x, y, w, h  Copy a bitmap (1 bit per lamp, rows padded to bytes)
+    GPU_SCROLL  dx, dy                  Move the display by signed offsets and clear the rest
+    GPU_LINE    x0, y0, x1, y1, color   Set the lamps of a line
+
+    The colors are GPU_OFF, GPU_ON and GPU_INVERT. Everything outside the display is
+    clipped. Unknown command bytes are ignored. The lamps are edited with NumPy, if it
+    is installed, else with plain Python.
+    """
+
+    def __init__(self, n1: N1) -> None:
+
+        self.n1: N1 = n1
+
+        self.command: int = -1
+        self.args: list[int] = []
+
+    def write(self, port: int, value: int) -> None:
+
+        if self.command == -1:
+            if value < len(GPU_ARGS):
+                self.command = value
+            return
+
+        self.args.append(value)
+
+        if len(self.args) == GPU_ARGS[self.command]:
+            command, args = self.command, self.args
+            self.command, self.args = -1, []
+            self.execute(command, args)
+
+    def reset(self) -> None:
+        """Drop a command, which was not completely written"""
+
+        self.command, self.args = -1, []
+
+    def save_state(self) -> tuple[int, tuple[int, ...]]:
+        return self.command, tuple(self.args)
+
+    def load_state(self, state: tuple[int, tuple[int, ...]]) -> None:
+
+        self.command, self.args = state[0], list(state[1])
+
+    def execute(self, command: int, args: list[int]) -> None:
+        """Execute a command with all its argument bytes"""
+
+        pixels = self.load()
+
+        if command == GPU_CLEAR:
+            self.fill(pixels, 0, 0, D_WIDTH, D_HEIGHT, args[0])
+        elif command == GPU_FILL:
+            self.fill(pixels, *args)
+        elif command == GPU_BLIT:
+            self.blit(pixels, args[0] << 8 | args[1], *args[2:])
+        elif command == GPU_SCROLL:
+            self.scroll(pixels, signed(args[0]), signed(args[1]))
+        elif command == GPU_LINE:
+            self.line(pixels, *args)
+
+        self.store(pixels)
+
+    def read_memory(self, addr: int, length: int) -> bytes:
+        """Read memory for a blit without side effects"""
+
+        if ADDR_ROM <= addr and addr + length <= ADDR_ROM + len(self.n1.rom):
+            return bytes(self.n1.rom[addr - ADDR_ROM:addr - ADDR_ROM + length])
+
+        return bytes(self.n1.peek(addr + i & 0xFFFF) for i in range(length))
+
+    def load(self) -> "np.ndarray | bytearray":
+        """Unpack the VRAM into one byte per lamp"""
+
+        vram = self.n1.bank_view(BANK_VRAM)[:D_SIZE]
+
+        if np is not None:
+            return np.unpackbits(np.frombuffer(vram, np.uint8)).reshape(D_HEIGHT, D_WIDTH)
+
+        return bytearray(byte >> 7 - bit & 1 for byte in vram for bit in range(8))
+
+    def store(self, pixels: "np.ndarray | bytearray") -> None:
+        """Pack the lamps back into the VRAM"""
+
+        vram = self.n1.allocate_bank(BANK_VRAM)
+        self.n1.mark_bank(BANK_VRAM, 0, D_SIZE)
+
+        if np is not None:
+            vram[:D_SIZE] = np.packbits(pixels).tobytes()
+            return
+
+        for i in range(D_SIZE):
+            byte = 0
+            for bit in pixels[i * 8:i * 8 + 8]:
+                byte = byte << 1 | bit
+            vram[i] = byte
+
+    def fill(self, pixels: "np.ndarray | bytearray", x: int, y: int, w: int, h: int, color: int) -> None:
+
+        x1, y1 = min(x + w, D_WIDTH), min(y + h, D_HEIGHT)
+
+        if x >= x1 or y >= y1:
+            return
+
+        if np is not None:
+            if color == GPU_INVERT:
+                pixels[y:y1, x:x1] ^= 1
+            else:
+                pixels[y:y1, x:x1] = color == GPU_ON
+            return
+
+        for row in range(y, y1):
+            start = row * D_WIDTH
+            if color == GPU_INVERT:
+                pixels[start + x:start + x1] = bytes(1 - pixel for pixel in pixels[start + x:start + x1])
+            else:
+                pixels[start + x:start + x1] = bytes([color == GPU_ON]) * (x1 - x)
+
+    def blit(self, pixels: "np.ndarray | bytearray", addr: int, x: int, y: int, w: int, h: int) -> None:
+
+        row = (w + 7) // 8
+        data = self.read_memory(addr, row * h)
+
+        x1, y1 = min(x + w, D_WIDTH), min(y + h, D_HEIGHT)
+
+        if x >= x1 or y >= y1:
+            return
+
+        if np is not None:
+            bitmap = np.unpackbits(np.frombuffer(data, np.uint8)).reshape(h, row * 8)
+            pixels[y:y1, x:x1] = bitmap[:y1 - y, :x1 - x]
+            return
+
+        for j in range(y1 - y):
+            for i in range(x1 - x):
+                pixels[(y + j) * D_WIDTH + x + i] = data[j * row + i // 8] >> 7 - i % 8 & 1
+
+    def scroll(self, pixels: "np.ndarray | bytearray", dx: int, dy: int) -> None:
+
+        if np is not None:
+            moved = np.zeros_like(pixels)
+            w, h = D_WIDTH - abs(dx), D_HEIGHT - abs(dy)
+            if w > 0 and h > 0:
+                moved[max(dy, 0):max(dy, 0) + h, max(dx, 0):max(dx, 0) + w] = \
+                    pixels[max(-dy, 0):max(-dy, 0) + h, max(-dx, 0):max(-dx, 0) + w]
+            pixels[:] = moved
+            return
+
+        old = bytes(pixels)
+        for y in range(D_HEIGHT):
+            for x in range(D_WIDTH):
+                sx, sy = x - dx, y - dy
+                inside = 0 <= sx < D_WIDTH and 0 <= sy < D_HEIGHT
+                pixels[y * D_WIDTH + x] = old[sy * D_WIDTH + sx] if inside else 0
+
+    def line(self, pixels: "np.ndarray | bytearray", x0: int, y0: int, x1: int, y1: int, color: int) -> None:
+
+        points = [(x, y) for x, y in line_points(x0, y0, x1, y1) if x < D_WIDTH and y < D_HEIGHT]
+
+        if not points:
+            return
+
+        if np is not None:
+            xs, ys = np.array(points).T
+            if color == GPU_INVERT:
+                pixels[ys, xs] ^= 1
+            else:
+                pixels[ys, xs] = color == GPU_ON
+            return
+
+        for x, y in points:
+            i = y * D_WIDTH + x
+            pixels[i] = 1 - pixels[i] if color == GPU_INVERT else int(color == GPU_ON)
@@ -0,0 +1,94 @@
+# Standard modules
+import random
+import sys
+import os
+
+# Path
+sys.path.append(os.path.abspath("../common"))
+
+# Local modules
+from constants import *
+from common import *
+from n1 import N1
+import gpu
+
+
+def command(rng: random.Random) -> list[int]:
+    """Generate a random command with arguments, which mostly hit the display"""
+
+    number = rng.randrange(len(GPU_ARGS))
+
+    def x() -> int:
+        return rng.randrange(D_WIDTH + 8) if rng.random() < 0.9 else rng.randrange(256)
+
+    def y() -> int:
+        return rng.randrange(D_HEIGHT + 8) if rng.random() < 0.9 else rng.randrange(256)
+
+    def color() -> int:
+        return rng.randrange(GPU_INVERT + 1)
+
+    if number == GPU_CLEAR:
+        args = [color()]
+    elif number == GPU_FILL:
+        args = [x(), y(), x(), y(), color()]
+    elif number == GPU_BLIT:
+        addr = rng.choice([rng.randrange(ADDR_ROM, ADDR_ROM + 0x100), rng.randrange(ADDR_RAM, ADDR_RAM + SIZE_RAM)])
+        args = [addr >> 8, addr & 0xFF, x(), y(), rng.randrange(1, 24), rng.randrange(1, 24)]
+    elif number == GPU_SCROLL:
+        args = [rng.randrange(-8, 9) & 0xFF, rng.randrange(-8, 9) & 0xFF]
+    else:
+        args = [x(), y(), x(), y(), color()]
+
+    return [number] + args
+
+
+def machine(rng: random.Random) -> N1:
+    """Create a machine with random ROM and RAM contents for the blits"""
+
+    n1 = N1()
+    n1.load_rom("".join(format(rng.randrange(256), "08b") for _ in range(0x100)))
+    n1.ram[:] = bytes(rng.randrange(256) for _ in range(SIZE_RAM))
+
+    return n1
+
+
+def main(args: list[str]) -> int:
+    """Compare the NumPy and plain Python paths of the GPU on the given number of random commands"""
+
+    if gpu.np is None:
+        print("NumPy is not installed, so there is nothing to compare!")
+        return 1
+
+    count = int(args[1]) if len(args) > 1 else 200
+    seed = int(args[2]) if len(args) > 2 else 0
+
+    numpy, python = machine(random.Random(seed)), machine(random.Random(seed))
+    rng = random.Random(seed + 1)
+
+    np = gpu.np
+
+    for i in range(count):
+
+        values = command(rng)
+
+        for n1, module in ((numpy, np), (python, None)):
+            gpu.np = module
+            try:
+                for value in values:
+                    n1.bus.write(PORT_GPU, value)
+            finally:
+                gpu.np = np
+
+        if numpy.bank_view(BANK_VRAM)[:D_SIZE] != python.bank_view(BANK_VRAM)[:D_SIZE]:
+            print(f"Different VRAM after command {i}: {values}")
+            return 1
+
+    print(f"Commands: {count} (identical VRAM with NumPy and plain Python)")
+
+    return 0
+
+
+# Main
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv))
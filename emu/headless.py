@@ -0,0 +1,94 @@
+# Standard modules
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+import time
+
+# Local modules
+from common import *
+from n1 import N1
+from translate import Translator
+from profiler import Profiler
+
+
+def run_program(path: str, cycles: int = 0, translate: bool = False, profile: bool = False,
+                functions: dict[int, str] | None = None, report: str | None = None,
+                collapsed: str | None = None) -> dict:
+    """Run a program without a window until it exits or the cycle budget (0 = unlimited) is used
+
+    With translation, whole basic blocks are executed, so the budget can be exceeded by one block.
+    Profiling uses the interpreter, because translated blocks bypass the instrumented tables. The
+    function map (address to name) groups the profile by function and the text report and the
+    collapsed stacks are written to the given paths.
+    """
+
+    n1 = N1()
+
+    try:
+        n1.load_file(path)
+    except (OSError, ValueError) as e:
+        return {"path": path, "error": str(e)}
+
+    translator = Translator(n1) if translate and not profile else None
+    step = translator.run if translator is not None else n1.step
+
+    profiler = Profiler(n1, functions) if profile else None
+    if profiler is not None:
+        profiler.attach()
+
+    instructions = 0
+    start = time.perf_counter()
+
+    if cycles:
+        while n1.exit == -1 and n1.cycles < cycles:
+            instructions += step(max(1, (cycles - n1.cycles) // MAX_CYCLES))
+            n1.bus.flush()
+    else:
+        while n1.exit == -1:
+            instructions += step(0x10000)
+            n1.bus.flush()
+
+    seconds = time.perf_counter() - start
+
+    result = {
+        "path": path,
+        "exit": n1.exit,
+        "registers": {name: n1.registers[i] for i, name in enumerate(REGISTER_NAME)},
+        "pc": n1.pc,
+        "sp": n1.sp,
+        "stack_peak": n1.stack_peak,
+        "mb": n1.mb,
+        "cycles": n1.cycles,
+        "instructions": instructions,
+        "seconds": seconds,
+        "ips": instructions / seconds if seconds else 0.0,
+    }
+
+    if translator is not None:
+        result["cache"] = translator.stats()
+
+    if profiler is not None:
+        profiler.detach()
+        result["profile"] = profiler.summary(10)
+        try:
+            if report is not None:
+                profiler.write_report(report)
+            if collapsed is not None:
+                profiler.write_collapsed(collapsed)
+        except OSError as e:
+            result["error"] = str(e)
+
+    return result
+
+
+def run_batch(paths: list[str], cycles: int = 0, jobs: int = 0, translate: bool = False,
+              profile: bool = False, functions: dict[int, str] | None = None) -> Iterator[dict]:
+    """Run many programs in a process pool (0 jobs = one per core) and yield the results in order"""
+
+    if jobs == 1 or len(paths) == 1:
+        for path in paths:
+            yield run_program(path, cycles, translate, profile, functions)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+        yield from executor.map(run_program, paths, [cycles] * len(paths), [translate] * len(paths),
+                                [profile] * len(paths), [functions] * len(paths))
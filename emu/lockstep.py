@@ -0,0 +1,426 @@
+# Standard modules
+from __future__ import annotations
+from typing import Callable
+import hashlib
+
+# External libraries
+import numpy as np
+
+# Local modules
+from common import *
+from n1 import R_H, R_L, R_F
+from alu import ADD, SBB, CMP, SHL, SHR, CARRY_SHIFT, BORROW_SHIFT
+from gpu import GPU
+
+
+def digest(ram: bytes, banks: dict[int, bytes]) -> str:
+    """Get a short digest of the RAM and the banks, which are not empty, to compare many runs"""
+
+    h = hashlib.blake2b(ram, digest_size=16)
+
+    for number in sorted(banks):
+        if any(banks[number]):
+            h.update(bytes([number]))
+            h.update(banks[number])
+
+    return h.hexdigest()
+
+
+class Instance:
+    """One instance of the lockstep engine with the memory access of a machine, which the GPU uses"""
+
+    def __init__(self, engine: Lockstep, i: int) -> None:
+
+        self.engine: Lockstep = engine
+        self.i: int = i
+
+        self.rom: np.ndarray = engine.rom
+
+    def bank_view(self, number: int) -> memoryview:
+
+        if number not in self.engine.banks:
+            return memoryview(bytes(SIZE_BANK))
+
+        return memoryview(self.engine.banks[number][self.i])
+
+    def allocate_bank(self, number: int) -> memoryview:
+        return memoryview(self.engine.bank(number)[self.i])
+
+    def mark_bank(self, number: int, start: int, end: int) -> None:
+        pass
+
+    def peek(self, addr: int) -> int:
+        """Read an address without side effects like N1.peek()"""
+
+        engine, i = self.engine, self.i
+
+        if ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
+            return int(engine.rom[addr - ADDR_ROM])
+        if ADDR_BANK <= addr < ADDR_BANK + SIZE_BANK:
+            return self.bank_view(int(engine.mb[i]))[addr - ADDR_BANK]
+        if ADDR_RAM <= addr < ADDR_RAM + SIZE_RAM:
+            return int(engine.ram[i, addr - ADDR_RAM])
+
+        values = {ADDR_MB: engine.mb[i], ADDR_SP: engine.sp[i] >> 8, ADDR_SP + 1: engine.sp[i] & 0xFF,
+                  ADDR_PC: engine.pc[i] >> 8, ADDR_PC + 1: engine.pc[i] & 0xFF}
+
+        return int(values.get(addr, 0))
+
+
+class Lockstep:
+    """Engine, which runs many N1 instances with the same ROM in lockstep with NumPy
+
+    The state of all instances is stored in arrays with the instance as first axis. Every
+    step executes one instruction of all running instances, grouped by their opcode. The
+    arrays can be seeded directly before running, e.g. registers[:, 0] = np.arange(n).
+    Writes to the GPU port are passed to one GPU per instance. Other devices are not
+    emulated, so reads of ports are 0 and writes to ports other than the exit and the
+    GPU port are ignored, like unconnected ports of the interpreter.
+    """
+
+    def __init__(self, rom: bytes, n: int) -> None:
+
+        self.n: int = n
+
+        self.rom: np.ndarray = np.zeros(SIZE_ROM, np.uint8)
+        self.rom[:len(rom)] = np.frombuffer(rom, np.uint8)[:SIZE_ROM]
+
+        self.registers: np.ndarray = np.zeros((n, 8), np.uint8)
+        self.pc: np.ndarray = np.full(n, ADDR_ROM, np.int64)
+        self.sp: np.ndarray = np.full(n, ADDR_STACK, np.int64)
+        self.mb: np.ndarray = np.full(n, BANK_RAM, np.int64)
+        self.exit: np.ndarray = np.full(n, -1, np.int64)
+        self.cycles: np.ndarray = np.zeros(n, np.int64)
+
+        # Pages of zeros are only allocated by the OS once they are written
+        self.ram: np.ndarray = np.zeros((n, SIZE_RAM), np.uint8)
+        self.banks: dict[int, np.ndarray] = {}  # Allocated on the first write to a bank number
+        self.stack: np.ndarray = np.zeros((n, SIZE_STACK), np.uint8)
+        self.gpus: dict[int, GPU] = {}  # Created on the first write to the GPU port of an instance
+
+        self.add: np.ndarray = np.frombuffer(ADD, np.uint16).astype(np.int64)
+        self.sbb: np.ndarray = np.frombuffer(SBB, np.uint16).astype(np.int64)
+        self.cmp: np.ndarray = np.frombuffer(CMP, np.uint8).astype(np.int64)
+        self.shl: np.ndarray = np.frombuffer(SHL, np.uint16).astype(np.int64)
+        self.shr: np.ndarray = np.frombuffer(SHR, np.uint16).astype(np.int64)
+
+        self.handlers: list[Callable[[np.ndarray, np.ndarray, np.ndarray], None]] = \
+            [getattr(self, "op_" + opcode.name) for opcode in OPCODES]
+        self.lengths: list[int] = [opcode.length for opcode in OPCODES]
+
+    def step(self, n: int = 1) -> int:
+        """Execute n instructions on all running instances and return the number of executed instructions"""
+
+        executed = 0
+
+        for _ in range(n):
+
+            active = np.flatnonzero(self.exit == -1)
+            if not len(active):
+                break
+
+            pc = self.pc[active]
+            byte = self.read(active, pc)
+            opcode = byte >> 3
+
+            for code in np.unique(opcode):
+                mask = opcode == code
+                idx = active[mask]
+                self.handlers[code](idx, byte[mask] & 0b111, pc[mask])
+                self.cycles[idx] += self.lengths[code]
+
+            executed += len(active)
+
+        return executed
+
+    def run(self, steps: int = 0x100000) -> int:
+        """Execute until all instances exited or the number of steps is reached"""
+
+        executed = 0
+
+        while steps > 0 and (self.exit == -1).any():
+            executed += self.step(min(steps, 0x100))
+            steps -= 0x100
+
+        return executed
+
+    def results(self) -> list[dict]:
+        """Get the exit code, registers, PC/SP/MB, cycles and a memory digest of every instance"""
+
+        names = REGISTER_NAME
+
+        banks = sorted(self.banks.items())
+
+        return [{
+            "exit": int(self.exit[i]),
+            "registers": dict(zip(names, self.registers[i].tolist())),
+            "pc": int(self.pc[i]),
+            "sp": int(self.sp[i]),
+            "mb": int(self.mb[i]),
+            "cycles": int(self.cycles[i]),
+            "digest": digest(self.ram[i].tobytes(), {number: bank[i].tobytes() for number, bank in banks}),
+        } for i in range(self.n)]
+
+    def fail(self, idx: np.ndarray, mask: np.ndarray, code: int) -> None:
+        self.exit[idx[mask]] = code
+
+    def read(self, idx: np.ndarray, addr: np.ndarray) -> np.ndarray:
+        """Read one address per instance"""
+
+        value = np.zeros(len(idx), np.int64)
+
+        rom = addr < ADDR_ROM + SIZE_ROM
+        value[rom] = self.rom[addr[rom] - ADDR_ROM]
+
+        bank = (ADDR_BANK <= addr) & (addr < ADDR_BANK + SIZE_BANK)
+        if bank.any():
+            i, mb, offset = idx[bank], self.mb[idx[bank]], addr[bank] - ADDR_BANK
+            v = np.zeros(len(i), np.int64)
+            for number in np.unique(mb).tolist():
+                if number in self.banks:
+                    same = mb == number
+                    v[same] = self.banks[number][i[same], offset[same]]
+            value[bank] = v
+
+        ram = (ADDR_RAM <= addr) & (addr < ADDR_RAM + SIZE_RAM)
+        value[ram] = self.ram[idx[ram], addr[ram] - ADDR_RAM]
+
+        other = ~(rom | bank | ram)
+        if other.any():
+            i, a = idx[other], addr[other]
+            v = np.zeros(len(i), np.int64)
+            v = np.where(a == ADDR_MB, self.mb[i], v)
+            v = np.where(a == ADDR_SP, self.sp[i] >> 8, v)
+            v = np.where(a == ADDR_SP + 1, self.sp[i] & 0xFF, v)
+            v = np.where(a == ADDR_PC, self.pc[i] >> 8, v)
+            v = np.where(a == ADDR_PC + 1, self.pc[i] & 0xFF, v)
+            self.fail(i, (a < ADDR_MB), EXIT_INVALID_ADDR)
+            value[other] = v
+
+        return value
+
+    def write(self, idx: np.ndarray, addr: np.ndarray, value: np.ndarray) -> None:
+        """Write one value to one address per instance"""
+
+        self.fail(idx, addr < ADDR_ROM + SIZE_ROM, EXIT_R_O_ACCESS)
+
+        bank = (ADDR_BANK <= addr) & (addr < ADDR_BANK + SIZE_BANK)
+        if bank.any():
+            i, mb, offset, v = idx[bank], self.mb[idx[bank]], addr[bank] - ADDR_BANK, value[bank]
+            for number in np.unique(mb).tolist():
+                same = mb == number
+                self.bank(number)[i[same], offset[same]] = v[same]
+
+        ram = (ADDR_RAM <= addr) & (addr < ADDR_RAM + SIZE_RAM)
+        self.ram[idx[ram], addr[ram] - ADDR_RAM] = value[ram]
+
+        mask = addr == ADDR_MB
+        self.mb[idx[mask]] = value[mask]
+
+        mask = addr == ADDR_SP
+        self.sp[idx[mask]] = value[mask] << 8 | self.sp[idx[mask]] & 0xFF
+
+        mask = addr == ADDR_SP + 1
+        self.sp[idx[mask]] = self.sp[idx[mask]] & 0xFF00 | value[mask]
+
+        self.fail(idx, addr >= ADDR_PC, EXIT_R_O_ACCESS)
+        self.fail(idx, (ADDR_RAM + SIZE_RAM <= addr) & (addr < ADDR_MB), EXIT_INVALID_ADDR)
+
+    def bank(self, number: int) -> np.ndarray:
+        """Get the arrays of a bank number for writing, which are allocated on the first write"""
+
+        if number not in self.banks:
+            self.banks[number] = np.zeros((self.n, SIZE_BANK), np.uint8)
+
+        return self.banks[number]
+
+    def out(self, idx: np.ndarray, port: np.ndarray, value: np.ndarray) -> None:
+        """Write one value to one port per instance"""
+
+        mask = port == PORT_EXIT
+        self.exit[idx[mask]] = value[mask]
+
+        mask = port == PORT_GPU
+        for i, v in zip(idx[mask].tolist(), value[mask].tolist()):
+            if i not in self.gpus:
+                self.gpus[i] = GPU(Instance(self, i))
+            self.gpus[i].write(PORT_GPU, v)
+
+    def push(self, idx: np.ndarray, value: np.ndarray) -> None:
+
+        offset = self.sp[idx] - ADDR_STACK
+        full = (offset < 0) | (offset >= SIZE_STACK)
+        self.fail(idx, full, EXIT_ST_OVERFLOW)
+
+        i = idx[~full]
+        self.stack[i, offset[~full]] = value[~full]
+        self.sp[i] += 1
+
+    def pop(self, idx: np.ndarray) -> np.ndarray:
+
+        offset = self.sp[idx] - ADDR_STACK - 1
+        empty = (offset < 0) | (offset >= SIZE_STACK)
+        self.fail(idx, empty, EXIT_ST_EMPTY)
+
+        i = idx[~empty]
+        value = np.zeros(len(idx), np.int64)
+        value[~empty] = self.stack[i, offset[~empty]]
+        self.sp[i] -= 1
+
+        return value
+
+    def operand(self, idx: np.ndarray, pc: np.ndarray, offset: int) -> np.ndarray:
+        return self.read(idx, (pc + offset) & 0xFFFF)
+
+    def source(self, idx: np.ndarray, pc: np.ndarray) -> np.ndarray:
+        """Get the value of the register in the second instruction byte"""
+        return self.registers[idx, self.operand(idx, pc, 1) & 0b111].astype(np.int64)
+
+    def hl(self, idx: np.ndarray) -> np.ndarray:
+        return self.registers[idx, R_H].astype(np.int64) << 8 | self.registers[idx, R_L]
+
+    def alu(self, idx: np.ndarray, r: np.ndarray, entry: np.ndarray) -> None:
+        self.registers[idx, r] = entry & 0xFF
+        self.registers[idx, R_F] = entry >> 8
+
+    def advance(self, idx: np.ndarray, pc: np.ndarray, length: int) -> None:
+        self.pc[idx] = (pc + length) & 0xFFFF
+
+    def op_mvi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = self.operand(idx, pc, 1)
+        self.advance(idx, pc, 2)
+
+    def op_mvr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = self.source(idx, pc)
+        self.advance(idx, pc, 2)
+
+    def op_lda(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        addr = self.operand(idx, pc, 1) << 8 | self.operand(idx, pc, 2)
+        self.registers[idx, r] = self.read(idx, addr)
+        self.advance(idx, pc, 3)
+
+    def op_ldhl(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = self.read(idx, self.hl(idx))
+        self.advance(idx, pc, 1)
+
+    def op_sta(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        addr = self.operand(idx, pc, 1) << 8 | self.operand(idx, pc, 2)
+        self.write(idx, addr, self.registers[idx, r].astype(np.int64))
+        self.advance(idx, pc, 3)
+
+    def op_sthl(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.write(idx, self.hl(idx), self.registers[idx, r].astype(np.int64))
+        self.advance(idx, pc, 1)
+
+    def op_pushi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.push(idx, self.operand(idx, pc, 1))
+        self.advance(idx, pc, 2)
+
+    def op_pushr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.push(idx, self.registers[idx, r].astype(np.int64))
+        self.advance(idx, pc, 1)
+
+    def op_pop(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = self.pop(idx)
+        self.advance(idx, pc, 1)
+
+    def op_nop(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.advance(idx, pc, 1)
+
+    def op_jnz(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.pc[idx] = np.where(self.registers[idx, r] != 0, self.hl(idx), (pc + 1) & 0xFFFF)
+
+    def op_jmp(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.pc[idx] = self.hl(idx)
+
+    def op_ini(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = 0
+        self.advance(idx, pc, 2)
+
+    def op_inr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = 0
+        self.advance(idx, pc, 2)
+
+    def op_outi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.out(idx, self.operand(idx, pc, 1), self.registers[idx, r].astype(np.int64))
+        self.advance(idx, pc, 2)
+
+    def op_outr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.out(idx, self.source(idx, pc), self.registers[idx, r].astype(np.int64))
+        self.advance(idx, pc, 2)
+
+    def op_addi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        self.alu(idx, r, self.add[a << 9 | self.operand(idx, pc, 1) << 1])
+        self.advance(idx, pc, 2)
+
+    def op_addr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        self.alu(idx, r, self.add[a << 9 | self.source(idx, pc) << 1])
+        self.advance(idx, pc, 2)
+
+    def op_adci(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        carry = self.registers[idx, R_F] >> CARRY_SHIFT & 1
+        self.alu(idx, r, self.add[a << 9 | self.operand(idx, pc, 1) << 1 | carry])
+        self.advance(idx, pc, 2)
+
+    def op_adcr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        carry = self.registers[idx, R_F] >> CARRY_SHIFT & 1
+        self.alu(idx, r, self.add[a << 9 | self.source(idx, pc) << 1 | carry])
+        self.advance(idx, pc, 2)
+
+    def op_andi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] &= self.operand(idx, pc, 1).astype(np.uint8)
+        self.advance(idx, pc, 2)
+
+    def op_andr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] &= self.source(idx, pc).astype(np.uint8)
+        self.advance(idx, pc, 2)
+
+    def op_ori(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] |= self.operand(idx, pc, 1).astype(np.uint8)
+        self.advance(idx, pc, 2)
+
+    def op_orr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] |= self.source(idx, pc).astype(np.uint8)
+        self.advance(idx, pc, 2)
+
+    def op_nori(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = ~(self.registers[idx, r] | self.operand(idx, pc, 1).astype(np.uint8))
+        self.advance(idx, pc, 2)
+
+    def op_norr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.registers[idx, r] = ~(self.registers[idx, r] | self.source(idx, pc).astype(np.uint8))
+        self.advance(idx, pc, 2)
+
+    def op_cmpi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        self.registers[idx, R_F] = self.cmp[a << 8 | self.operand(idx, pc, 1)]
+        self.advance(idx, pc, 2)
+
+    def op_cmpr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        self.registers[idx, R_F] = self.cmp[a << 8 | self.source(idx, pc)]
+        self.advance(idx, pc, 2)
+
+    def op_sbbi(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        borrow = self.registers[idx, R_F] >> BORROW_SHIFT & 1
+        self.alu(idx, r, self.sbb[a << 9 | self.operand(idx, pc, 1) << 1 | borrow])
+        self.advance(idx, pc, 2)
+
+    def op_sbbr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        a = self.registers[idx, r].astype(np.int64)
+        borrow = self.registers[idx, R_F] >> BORROW_SHIFT & 1
+        self.alu(idx, r, self.sbb[a << 9 | self.source(idx, pc) << 1 | borrow])
+        self.advance(idx, pc, 2)
+
+    def op_shl(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.alu(idx, r, self.shl[self.registers[idx, r]])
+        self.advance(idx, pc, 1)
+
+    def op_shr(self, idx: np.ndarray, r: np.ndarray, pc: np.ndarray) -> None:
+        self.alu(idx, r, self.shr[self.registers[idx, r]])
+        self.advance(idx, pc, 1)
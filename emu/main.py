@@ -1,4 +1,7 @@
 # Standard modules
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import json
 import sys
 import os
 
@@ -10,8 +13,14 @@ sys.path.append(os.path.abspath("../common"))
 
 # Local modules
 from common import *
-from win import Win
 from n1 import N1
+from headless import run_batch, run_program
+from profiler import load_functions
+from cpu import CPU
+from debugger import Debugger
+
+if TYPE_CHECKING:
+    from win import Win
 
 
 class Global:
@@ -21,10 +30,14 @@ class Global:
 
         self.debug: bool = False
         self.path: str = ""
+        self.frequency: int = 0
+        self.translate: bool = False
 
         self.win: Win = None
+        self.cpu: CPU = None
 
         self.n1: N1 = None
+        self.debugger: Debugger = None
 
 
 def print_help() -> None:
@@ -36,12 +49,41 @@ def print_help() -> None:
     print()
     print("--- Usage ---")
     print()
-    print("python emu.py [-h/--help] [-d/--debug] path")
+    print("python emu.py [-h/--help] [-d/--debug] [-t/--translate] [-f/--frequency n] path")
+    print("python emu.py -H/--headless [-t/--translate] [-p/--profile] [-c/--cycles n] [-j/--jobs n] path [path ...]")
+    print("python emu.py -H/--headless [--functions file] [--report file] [--collapsed file] path")
+    print()
+    print("-h/--help       Show this help message")
+    print("-d/--debug      Print debug information")
+    print("-H/--headless   Run without a window and print the results as JSON lines")
+    print("-t/--translate  Execute translated basic blocks instead of single instructions")
+    print("-p/--profile    Add a hot spot profile to the results of a headless run")
+    print("-f/--frequency  Clock frequency in Hz of the CPU (default: 0 = unthrottled turbo)")
+    print("-c/--cycles     Stop a headless run after n cycles (default: until exit)")
+    print("-j/--jobs       Number of processes for headless runs (default: one per core)")
+    print("--functions     Function map for the profile with one 'address name' per line")
+    print("--report        Write the hot spot report of the profile of one program to a file")
+    print("--collapsed     Write the call stacks of the profile of one program for flamegraph tools")
+    print()
+    print("path            File path of .n1 or .n1b file to execute")
+    print()
+    print("--- Debugger ---")
     print()
-    print("-h/--help     Show this help message")
-    print("-d/--debug    Print debug information")
+    print("F5              Pause or resume the CPU")
+    print("F6              Enter a debugger command, Enter executes it, Escape cancels it")
+    print("F9              Toggle a breakpoint at the current PC while paused")
+    print("F10             Execute a single instruction while paused")
+    print("F8              Remove all breakpoints and watchpoints")
     print()
-    print("path          File path of .n1 file to execute")
+    print("--- Debugger commands ---")
+    print()
+    print("b ADDR [COND]           Add a breakpoint with an optional register condition like a==5")
+    print("rb ADDR                 Remove a breakpoint")
+    print("w START [END] [BANK]    Watch writes to an address range, optionally only in one bank")
+    print("w ram|vram [START END]  Watch writes to (a range of) the RAM or VRAM")
+    print("w bank N [START END]    Watch writes to (a range of) a bank")
+    print("rw                      Remove all watchpoints")
+    print("c                       Remove all breakpoints and watchpoints")
     print()
 
 
@@ -62,11 +104,88 @@ def main(args: list[str]) -> int:
         if "--debug" in args:
             args.remove('--debug')
 
+    headless = "-H" in args or "--headless" in args
+
+    if headless:
+        if "-H" in args:
+            args.remove('-H')
+        if "--headless" in args:
+            args.remove('--headless')
+
+    translate = "-t" in args or "--translate" in args
+
+    if translate:
+        if "-t" in args:
+            args.remove('-t')
+        if "--translate" in args:
+            args.remove('--translate')
+
+    profile = "-p" in args or "--profile" in args
+
+    if profile:
+        if "-p" in args:
+            args.remove('-p')
+        if "--profile" in args:
+            args.remove('--profile')
+
+    options = {"frequency": 0, "cycles": 0, "jobs": 0}
+
+    for name in options:
+        for flag in ("-" + name[0], "--" + name):
+            if flag not in args:
+                continue
+            index = args.index(flag)
+            if index + 1 >= len(args) or not args[index + 1].isdigit():
+                print(f"Invalid value for '{flag}'! A number is expected. Add '-h' or '--help' for help ...")
+                return 1
+            options[name] = int(args[index + 1])
+            del args[index:index + 2]
+
+    files = {"functions": None, "report": None, "collapsed": None}
+
+    for name in files:
+        flag = "--" + name
+        if flag not in args:
+            continue
+        index = args.index(flag)
+        if index + 1 >= len(args):
+            print(f"Invalid value for '{flag}'! A file path is expected. Add '-h' or '--help' for help ...")
+            return 1
+        files[name] = os.path.abspath(args[index + 1])
+        del args[index:index + 2]
+
     if len(args) < 2:
         print("Missing file argument! Add '-h' or '--help' for help ...")
         return 1
 
+    if any(files.values()) and not headless:
+        print("The profile options are only available for headless runs! Add '-h' or '--help' for help ...")
+        return 1
+
+    if headless:
+        paths = [os.path.abspath(arg) for arg in args[1:]]
+
+        if (files["report"] or files["collapsed"]) and len(paths) > 1:
+            print("A report or call stacks can only be written for one program! Add '-h' or '--help' for help ...")
+            return 1
+
+        functions = None
+        if files["functions"]:
+            try:
+                functions = load_functions(files["functions"])
+            except (OSError, ValueError) as e:
+                print(e)
+                return 1
+
+        # The profile options imply a profile
+        profile = profile or any(files.values())
+
+        return main_headless(paths, options["cycles"], options["jobs"], translate, profile, functions,
+                             files["report"], files["collapsed"])
+
     glob.path = os.path.abspath(args[-1])
+    glob.frequency = options["frequency"]
+    glob.translate = translate
 
     if not os.path.exists(glob.path):
         print("Invalid file path! File don't exists. Add '-h' or '--help' for help ...")
@@ -75,20 +194,48 @@ def main(args: list[str]) -> int:
         print("Invalid file path! Not a file. Add '-h' or '--help' for help ...")
         return 1
 
-    with open(glob.path, 'r') as f:
-        code = f.read()
-
     glob.n1 = N1()
-    glob.n1.load_rom(code)
+
+    try:
+        glob.n1.load_file(glob.path)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    glob.debugger = Debugger(glob.n1)
+
+    from win import Win
+
+    glob.cpu = CPU(glob)
+    glob.cpu.start()
 
     glob.win = Win(glob)
     glob.win.start()
 
-    print(glob.n1.rom)
+    print(glob.n1.rom.hex())
 
     return 0
 
 
+def main_headless(paths: list[str], cycles: int, jobs: int, translate: bool, profile: bool,
+                  functions: dict[int, str] | None = None, report: str | None = None,
+                  collapsed: str | None = None) -> int:
+    """Run programs without a window and print one JSON line per program"""
+
+    failed = False
+
+    if report or collapsed:
+        results = [run_program(paths[0], cycles, translate, profile, functions, report, collapsed)]
+    else:
+        results = run_batch(paths, cycles, jobs, translate, profile, functions)
+
+    for result in results:
+        failed = failed or "error" in result
+        print(json.dumps(result), flush=True)
+
+    return 1 if failed else 0
+
+
 # Main
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
@@ -1,5 +1,23 @@
+# Standard modules
+from functools import partial
+import mmap
+from typing import Callable
+
 # Local modules
 from common import *
+from executable import Header, HEADER, text2rom
+from savestate import Snapshot
+from bus import Bus
+from gpu import GPU
+from alu import ADD, SBB, CMP, SHL, SHR, CARRY_SHIFT, BORROW_SHIFT
+
+
+R_H = REGISTER_CODE["h"]
+R_L = REGISTER_CODE["l"]
+R_F = REGISTER_CODE["f"]
+
+# Contents of all banks, which were never written
+ZERO_BANK = memoryview(bytes(SIZE_BANK))
 
 
 class N1:
@@ -7,92 +25,561 @@ class N1:
 
     def __init__(self) -> None:
 
-        self.registers: dict[str, int] = {"a": 0, "b": 0, "c": 0, "d": 0, "h": 0, "l": 0, "z": 0, "f": 0}
+        self.registers: bytearray = bytearray(8)
         self.mb: int = BANK_RAM
-        self.sp: tuple[int, int] = split16(ADDR_STACK)
-        self.pc: tuple[int, int] = split16(ADDR_ROM)
+        self.sp: int = ADDR_STACK
+        self.pc: int = ADDR_ROM
+        self.entry: int = ADDR_ROM
+
+        self.memory: bytearray = bytearray(0x10000)
+        self.rom: memoryview = memoryview(self.memory)[ADDR_ROM:ADDR_ROM + SIZE_ROM]
+        self.ram: memoryview = memoryview(self.memory)[ADDR_RAM:ADDR_RAM + SIZE_RAM]
+        self.banks: dict[int, memoryview] = {}
+        self.bank: memoryview = ZERO_BANK
+        self.bank_file: mmap.mmap | None = None
+        self.stack: memoryview = memoryview(self.memory)[ADDR_STACK:ADDR_STACK + SIZE_STACK]
+        self.stack_peak: int = 0
 
-        self.rom: dict[int, int] = {}
-        self.bank: dict[int, dict[int, int]] = {BANK_RAM: {}, BANK_VRAM: {}}
-        self.ram: dict[int, int] = {}
-        self.stack: list[int] = []
+        self.bus: Bus = Bus(self)
+        self.bus.connect(PORT_GPU, GPU(self))
+
+        self.rom_file: mmap.mmap | None = None
+        self.last_snapshot: Snapshot | None = None
+
+        # Pages written since the last snapshot, by address page and by bank number << 8 | address page
+        self.dirty: set[int] = set()
+        self.dirty_banks: set[int] = set()
 
         self.exit: int = -1
+        self.cycles: int = 0
+        self.aborted: bool = False  # The last instruction was aborted by a breakpoint
+
+        self.page_get: list[Callable[[int], int]] = []
+        self.page_set: list[Callable[[int, int], None]] = []
+        self.build_pages()
+
+        self.dispatch: list[Callable[[], int]] = self.build_dispatch()
 
     def reset(self) -> None:
 
-        self.registers = {"a": 0, "b": 0, "c": 0, "d": 0, "h": 0, "l": 0, "z": 0, "f": 0}
+        self.registers[:] = bytes(8)
         self.mb = BANK_RAM
-        self.sp = split16(ADDR_STACK)
-        self.pc = split16(ADDR_ROM)
+        self.sp = ADDR_STACK
+        self.pc = self.entry
 
-        for bank in self.bank:
-            bank.clear()
-        self.ram.clear()
-        self.stack.clear()
+        self.memory[ADDR_BANK:] = bytes(0x10000 - ADDR_BANK)
+        if self.bank_file is None:
+            self.banks.clear()
+        self.bank = self.bank_view(self.mb)
+        self.stack_peak = 0
 
         self.exit = -1
+        self.cycles = 0
+
+        self.bus.reset()
+
+        # The memory changed without going through the page table
+        self.last_snapshot = None
+
+    def snapshot(self) -> Snapshot:
+        """Capture the machine state, copying only the pages written since the last snapshot"""
+
+        self.last_snapshot = Snapshot.capture(self, self.last_snapshot)
+
+        self.dirty.clear()
+        self.dirty_banks.clear()
+
+        return self.last_snapshot
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """Restore the machine state from a snapshot"""
+
+        self.registers[:] = snapshot.registers
+        self.pc = snapshot.pc
+        self.sp = snapshot.sp
+        self.stack_peak = snapshot.stack_peak
+        self.mb = snapshot.mb
+        self.exit = snapshot.exit
+        self.cycles = snapshot.cycles
+
+        self.ram[:] = b"".join(snapshot.ram)
+        self.stack[:] = b"".join(snapshot.stack)
+
+        for number in list(self.banks):
+            if number in snapshot.banks:
+                continue
+            if self.bank_file is None:
+                del self.banks[number]
+            else:
+                self.banks[number][:] = bytes(SIZE_BANK)
+
+        for number, pages in snapshot.banks.items():
+            self.allocate_bank(number)[:] = b"".join(pages)
+
+        self.bank = self.bank_view(self.mb)
+
+        self.bus.load_state(snapshot.devices)
+
+        self.last_snapshot = snapshot
+
+        self.dirty.clear()
+        self.dirty_banks.clear()
 
     def load_rom(self, string: str) -> None:
 
-        self.rom.clear()
+        data = text2rom(string)
+
+        self.map_rom(memoryview(self.memory)[ADDR_ROM:ADDR_ROM + SIZE_ROM])
+        self.rom[:] = bytes(SIZE_ROM)
+        self.rom[:len(data)] = data[:SIZE_ROM]
+
+        self.entry = ADDR_ROM
+        self.pc = self.entry
+
+    def load_file(self, path: str) -> None:
+        """Load a text (.n1) or binary (.n1b) executable depending on the file extension"""
+
+        if path.endswith(".n1b"):
+            self.load_executable(path)
+            return
+
+        with open(path, "r") as f:
+            self.load_rom(f.read())
+
+    def load_executable(self, path: str) -> None:
+        """Load a binary executable (.n1b) by mapping its ROM section directly from the file"""
+
+        with open(path, "rb") as f:
+            rom_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header = Header.unpack(rom_file)
+        except ValueError:
+            rom_file.close()
+            raise
+
+        self.map_rom(memoryview(rom_file)[HEADER.size:HEADER.size + header.rom_length])
+        self.rom_file = rom_file
+
+        self.entry = header.entry
+        self.pc = self.entry
+
+    def map_rom(self, rom: memoryview) -> None:
+        """Map a buffer as ROM into the page table without copying it"""
+
+        if self.rom_file is not None:
+            self.rom.release()
+            self.rom_file.close()
+            self.rom_file = None
+
+        self.rom = rom
+
+        for page in range(ADDR_ROM >> 8, (ADDR_ROM + SIZE_ROM) >> 8):
+            full = (page + 1 << 8) - ADDR_ROM <= len(rom)
+            self.page_get[page] = rom.__getitem__ if full else self.rom_get
+
+    def bank_view(self, number: int) -> memoryview:
+        """Get a bank for reading, which is the shared zero bank, if it was never written"""
+
+        return self.banks.get(number, ZERO_BANK)
+
+    def allocate_bank(self, number: int) -> memoryview:
+        """Get a bank for writing, which is allocated on the first write"""
+
+        bank = self.banks.get(number)
+
+        if bank is None:
+            bank = self.banks[number] = memoryview(bytearray(SIZE_BANK))
+            if number == self.mb:
+                self.bank = bank
+
+        return bank
+
+    def mark_bank(self, number: int, start: int, end: int) -> None:
+        """Mark the pages of the offset range [start, end) of a bank as written for the next snapshot"""
+
+        first, last = ADDR_BANK + start >> 8, ADDR_BANK + end - 1 >> 8
+
+        self.dirty_banks.update(number << 8 | page for page in range(first, last + 1))
+
+    def map_banks(self, path: str) -> None:
+        """Back all banks by a sparse file, which keeps their contents between runs and resets"""
+
+        size = BANK_COUNT * SIZE_BANK
+
+        with open(path, "a+b") as f:
+            if f.seek(0, 2) < size:
+                f.truncate(size)
+            bank_file = mmap.mmap(f.fileno(), size)
+
+        if self.bank_file is not None:
+            self.banks.clear()
+            self.bank = ZERO_BANK
+            self.bank_file.close()
+
+        view = memoryview(bank_file)
+
+        self.banks = {number: view[number * SIZE_BANK:(number + 1) * SIZE_BANK] for number in range(BANK_COUNT)}
+        self.bank = self.banks[self.mb]
+        self.bank_file = bank_file
+
+        self.last_snapshot = None
+
+    def build_pages(self) -> None:
+        """Build the page table, which routes every access by the high address byte to its region"""
+
+        self.page_get.clear()
+        self.page_set.clear()
+
+        for page in range(256):
+
+            addr = page << 8
+
+            if ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
+                self.page_get.append(self.rom.__getitem__)
+                self.page_set.append(self.rom_set)
+
+            elif ADDR_BANK <= addr < ADDR_BANK + SIZE_BANK:
+                self.page_get.append(self.bank_get)
+                self.page_set.append(self.bank_set)
+
+            elif ADDR_RAM <= addr < ADDR_RAM + SIZE_RAM:
+                self.page_get.append(self.memory.__getitem__)
+                self.page_set.append(self.ram_set)
+
+            elif page != 0xFF:
+                self.page_get.append(self.invalid_get)
+                self.page_set.append(self.invalid_set)
+
+            else:
+                self.page_get.append(self.mmio_get)
+                self.page_set.append(self.mmio_set)
+
+    def build_dispatch(self) -> list[Callable[[], int]]:
+        """Build the dispatch table, which maps every first instruction byte to a bound handler"""
+
+        dispatch = []
+
+        for byte in range(256):
+            dispatch.append(partial(getattr(self, "op_" + OPCODES[byte >> 3].name), byte & 0b111))
+
+        return dispatch
+
+    def step(self, n: int = 1) -> int:
+        """Execute up to n instructions and return the number of executed instructions"""
+
+        dispatch = self.dispatch
+        page_get = self.page_get
+
+        # An instruction aborted by a breakpoint is not counted
+        self.aborted = False
+
+        for executed in range(n):
+            if self.exit != -1:
+                return executed - self.aborted
+            pc = self.pc
+            self.cycles += dispatch[page_get[pc >> 8](pc)]()
+
+        return n - self.aborted
+
+    def run_until_exit(self) -> int:
+        """Execute instructions until the machine exits and return the exit code"""
+
+        while self.exit == -1:
+            self.step(0x10000)
+
+        return self.exit
+
+    def hl_get(self) -> int:
+        return self.registers[R_H] << 8 | self.registers[R_L]
 
-        for i in range(0, len(string), 8):
-            self.rom[ADDR_ROM + i // 8] = string[i:i+8]
+    def operand(self, offset: int) -> int:
+        return self.addr_get((self.pc + offset) & 0xFFFF)
+
+    def push(self, value: int) -> None:
+        """Write a value to the stack region at SP and increment SP"""
+
+        sp = self.sp
+
+        if not ADDR_STACK <= sp < ADDR_STACK + SIZE_STACK:
+            self.exit = EXIT_ST_OVERFLOW
+            return
+
+        self.memory[sp] = value
+        self.dirty.add(sp >> 8)
+        sp += 1
+        self.sp = sp
+
+        if sp - ADDR_STACK > self.stack_peak:
+            self.stack_peak = sp - ADDR_STACK
+
+    def pop(self) -> int:
+        """Decrement SP and read the value from the stack region at SP"""
+
+        sp = self.sp - 1
+
+        if not ADDR_STACK <= sp < ADDR_STACK + SIZE_STACK:
+            self.exit = EXIT_ST_EMPTY
+            return 0
+
+        self.sp = sp
+        return self.memory[sp]
+
+    def alu(self, r: int, entry: int) -> None:
+        """Store an ALU table entry (result | flags << 8) into a register and the flags"""
+
+        self.registers[r] = entry & 0xFF
+        self.registers[R_F] = entry >> 8
+
+    def op_mvi(self, r: int) -> int:
+        self.registers[r] = self.operand(1)
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_mvr(self, r: int) -> int:
+        self.registers[r] = self.registers[self.operand(1) & 0b111]
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_lda(self, r: int) -> int:
+        self.registers[r] = self.addr_get(self.operand(1) << 8 | self.operand(2))
+        self.pc = self.pc + 3 & 0xFFFF
+        return 3
+
+    def op_ldhl(self, r: int) -> int:
+        self.registers[r] = self.addr_get(self.hl_get())
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_sta(self, r: int) -> int:
+        self.addr_set(self.operand(1) << 8 | self.operand(2), self.registers[r])
+        self.pc = self.pc + 3 & 0xFFFF
+        return 3
+
+    def op_sthl(self, r: int) -> int:
+        self.addr_set(self.hl_get(), self.registers[r])
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_pushi(self, r: int) -> int:
+        self.push(self.operand(1))
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_pushr(self, r: int) -> int:
+        self.push(self.registers[r])
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_pop(self, r: int) -> int:
+        self.registers[r] = self.pop()
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_nop(self, r: int) -> int:
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_jnz(self, r: int) -> int:
+        self.pc = self.hl_get() if self.registers[r] != 0 else self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_jmp(self, r: int) -> int:
+        self.pc = self.hl_get()
+        return 1
+
+    def op_ini(self, r: int) -> int:
+        self.registers[r] = self.bus.read(self.operand(1))
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_inr(self, r: int) -> int:
+        self.registers[r] = self.bus.read(self.registers[self.operand(1) & 0b111])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_outi(self, r: int) -> int:
+        self.bus.write(self.operand(1), self.registers[r])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_outr(self, r: int) -> int:
+        self.bus.write(self.registers[self.operand(1) & 0b111], self.registers[r])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_addi(self, r: int) -> int:
+        self.alu(r, ADD[self.registers[r] << 9 | self.operand(1) << 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_addr(self, r: int) -> int:
+        self.alu(r, ADD[self.registers[r] << 9 | self.registers[self.operand(1) & 0b111] << 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_adci(self, r: int) -> int:
+        self.alu(r, ADD[self.registers[r] << 9 | self.operand(1) << 1 | self.registers[R_F] >> CARRY_SHIFT & 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_adcr(self, r: int) -> int:
+        b = self.registers[self.operand(1) & 0b111]
+        self.alu(r, ADD[self.registers[r] << 9 | b << 1 | self.registers[R_F] >> CARRY_SHIFT & 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_andi(self, r: int) -> int:
+        self.registers[r] &= self.operand(1)
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_andr(self, r: int) -> int:
+        self.registers[r] &= self.registers[self.operand(1) & 0b111]
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_ori(self, r: int) -> int:
+        self.registers[r] |= self.operand(1)
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_orr(self, r: int) -> int:
+        self.registers[r] |= self.registers[self.operand(1) & 0b111]
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_nori(self, r: int) -> int:
+        self.registers[r] = ~(self.registers[r] | self.operand(1)) & 0xFF
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_norr(self, r: int) -> int:
+        self.registers[r] = ~(self.registers[r] | self.registers[self.operand(1) & 0b111]) & 0xFF
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_cmpi(self, r: int) -> int:
+        self.registers[R_F] = CMP[self.registers[r] << 8 | self.operand(1)]
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_cmpr(self, r: int) -> int:
+        self.registers[R_F] = CMP[self.registers[r] << 8 | self.registers[self.operand(1) & 0b111]]
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_sbbi(self, r: int) -> int:
+        self.alu(r, SBB[self.registers[r] << 9 | self.operand(1) << 1 | self.registers[R_F] >> BORROW_SHIFT & 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_sbbr(self, r: int) -> int:
+        b = self.registers[self.operand(1) & 0b111]
+        self.alu(r, SBB[self.registers[r] << 9 | b << 1 | self.registers[R_F] >> BORROW_SHIFT & 1])
+        self.pc = self.pc + 2 & 0xFFFF
+        return 2
+
+    def op_shl(self, r: int) -> int:
+        self.alu(r, SHL[self.registers[r]])
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
+
+    def op_shr(self, r: int) -> int:
+        self.alu(r, SHR[self.registers[r]])
+        self.pc = self.pc + 1 & 0xFFFF
+        return 1
 
     def addr_get(self, addr: int) -> int:
+        return self.page_get[addr >> 8](addr)
+
+    def addr_set(self, addr: int, value: int) -> None:
+        self.page_set[addr >> 8](addr, value)
+
+    def peek(self, addr: int) -> int:
+        """Read an address without side effects, so invalid addresses and banks read as 0"""
 
         if ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
-            return self.rom[addr] if addr in self.rom else 0
+            return self.rom_get(addr)
 
         if ADDR_BANK <= addr < ADDR_BANK + SIZE_BANK:
-            if self.mb not in self.bank:
-                self.exit = EXIT_INVALID_BANK
-                return 0
-            return self.bank[self.mb][addr] if addr in self.bank[self.mb] else 0
+            return self.bank[addr - ADDR_BANK]
 
         if ADDR_RAM <= addr < ADDR_RAM + SIZE_RAM:
-            return self.ram[addr] if addr in self.ram else 0
+            return self.memory[addr]
 
-        if ADDR_MB == addr:
-            return self.mb
-        
-        if ADDR_SP <= addr < ADDR_SP + 1:
-            return self.sp[addr - ADDR_SP]
+        if ADDR_MB <= addr:
+            return self.mmio_get(addr)
+
+        return 0
+
+    def rom_get(self, addr: int) -> int:
+        return self.rom[addr - ADDR_ROM] if addr - ADDR_ROM < len(self.rom) else 0
+
+    def rom_set(self, addr: int, value: int) -> None:
+        self.exit = EXIT_R_O_ACCESS
+
+    def bank_get(self, addr: int) -> int:
+        return self.bank[addr - ADDR_BANK]
+
+    def bank_set(self, addr: int, value: int) -> None:
 
-        if ADDR_PC <= addr < ADDR_PC + 1:
-            return self.pc[addr - ADDR_PC]
+        bank = self.bank
 
+        if bank is ZERO_BANK:
+            bank = self.allocate_bank(self.mb)
+
+        bank[addr - ADDR_BANK] = value
+        self.dirty_banks.add(self.mb << 8 | addr >> 8)
+
+    def ram_set(self, addr: int, value: int) -> None:
+
+        self.memory[addr] = value
+        self.dirty.add(addr >> 8)
+
+    def invalid_get(self, addr: int) -> int:
         self.exit = EXIT_INVALID_ADDR
         return 0
-    
-    def addr_set(self, addr: int, value: int) -> None:
 
-        if ADDR_BANK <= addr < ADDR_BANK + SIZE_BANK:
-            if self.mb not in self.bank:
-                self.exit = EXIT_INVALID_BANK
-                return
-            self.bank[self.mb][addr] = value
-            return
+    def invalid_set(self, addr: int, value: int) -> None:
+        self.exit = EXIT_INVALID_ADDR
 
-        if ADDR_RAM <= addr < ADDR_RAM + SIZE_RAM:
-            self.ram[addr] = value
-            return
+    def mmio_get(self, addr: int) -> int:
+
+        if ADDR_MB == addr:
+            return self.mb
+
+        if ADDR_SP == addr:
+            return self.sp >> 8
+
+        if ADDR_SP + 1 == addr:
+            return self.sp & 0xFF
+
+        if ADDR_PC == addr:
+            return self.pc >> 8
+
+        if ADDR_PC + 1 == addr:
+            return self.pc & 0xFF
+
+        return self.invalid_get(addr)
+
+    def mmio_set(self, addr: int, value: int) -> None:
 
         if ADDR_MB == addr:
             self.mb = value
+            self.bank = self.banks.get(value, ZERO_BANK)
             return
 
-        if ADDR_SP <= addr < ADDR_SP + 1:
-            if addr == ADDR_SP:
-                self.sp = value, self.sp[1]
-            else:
-                self.sp = self.sp[0], value
+        if ADDR_SP == addr:
+            self.sp = value << 8 | self.sp & 0xFF
             return
 
-        if ADDR_PC <= addr < ADDR_PC + 1 or ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
-            self.exit = EXIT_R_O_ACCESS
+        if ADDR_SP + 1 == addr:
+            self.sp = self.sp & 0xFF00 | value
             return
 
-        self.exit = EXIT_INVALID_ADDR
+        if ADDR_PC <= addr < ADDR_PC + 2:
+            self.exit = EXIT_R_O_ACCESS
+            return
 
+        self.invalid_set(addr, value)
@@ -0,0 +1,290 @@
+# Standard modules
+from bisect import bisect_right
+from typing import Callable
+
+# Local modules
+from common import *
+from n1 import N1
+
+
+# Memory regions of the access counters
+REGIONS = ("rom", "bank", "ram", "stack", "mmio", "invalid")
+
+# Name of the frame at the bottom of every collapsed stack
+ROOT = "root"
+
+
+def page_region(page: int) -> str:
+    """Get the memory region of a page (high address byte)"""
+
+    addr = page << 8
+
+    if ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
+        return "rom"
+    if ADDR_BANK <= addr < ADDR_BANK + SIZE_BANK:
+        return "bank"
+    if ADDR_RAM <= addr < ADDR_RAM + SIZE_RAM:
+        return "ram"
+    if page == 0xFF:
+        return "mmio"
+    return "invalid"
+
+
+def load_functions(path: str) -> dict[int, str]:
+    """Load a function map with one address and name per line like '0x0040 draw' and ';' comments"""
+
+    functions = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+
+            words = line.split(";")[0].split()
+            if not words:
+                continue
+
+            if len(words) != 2:
+                raise ValueError(f"Invalid function map! Line {number} needs an address and a name.")
+
+            try:
+                addr = int(words[0], 0)
+            except ValueError:
+                raise ValueError(f"Invalid function map! Invalid address {words[0]!r} in line {number}.") from None
+
+            if not 0 <= addr <= 0xFFFF:
+                raise ValueError(f"Invalid function map! Address {words[0]} in line {number} is out of range.")
+
+            functions[addr] = words[1]
+
+    return functions
+
+
+class Profiler:
+    """Opt-in profiler, which swaps instrumented dispatch and page tables into the machine
+
+    While attached, every instruction is counted with its cycles per address and opcode,
+    every memory access per region (including instruction fetches) and every push/pop as
+    stack access. A call is a jump to a function address after a return address was pushed
+    and returns, when the stack drops below its level at the call. Attach after loading the ROM and use the
+    interpreter, because translated blocks don't use the dispatch table.
+    """
+
+    def __init__(self, n1: N1, functions: dict[int, str] | None = None) -> None:
+
+        self.n1: N1 = n1
+        self.functions: dict[int, str] = functions or {}
+        self.function_addrs: list[int] = sorted(self.functions)
+
+        self.executions: list[int] = [0] * 0x10000
+        self.cycles: list[int] = [0] * 0x10000
+        self.opcode_executions: list[int] = [0] * len(OPCODES)
+        self.opcode_cycles: list[int] = [0] * len(OPCODES)
+        self.reads: dict[str, int] = dict.fromkeys(REGIONS, 0)
+        self.writes: dict[str, int] = dict.fromkeys(REGIONS, 0)
+
+        self.frames: list[tuple[str, int]] = [(ROOT, ADDR_STACK)]
+        self.frame_key: str = ROOT
+        self.stacks: dict[str, int] = {}
+
+        self.original: tuple[list, list, list] | None = None
+
+    @property
+    def attached(self) -> bool:
+        return self.original is not None
+
+    def attach(self) -> None:
+        """Swap the instrumented tables into the machine"""
+
+        if self.attached:
+            return
+
+        n1 = self.n1
+        self.original = (n1.dispatch, n1.page_get, n1.page_set)
+
+        n1.dispatch = [self.instrument(handler, byte >> 3) for byte, handler in enumerate(n1.dispatch)]
+        n1.page_get = [self.count_get(get, page_region(page)) for page, get in enumerate(n1.page_get)]
+        n1.page_set = [self.count_set(set_, page_region(page)) for page, set_ in enumerate(n1.page_set)]
+
+    def detach(self) -> None:
+        """Restore the original tables of the machine"""
+
+        if not self.attached:
+            return
+
+        self.n1.dispatch, self.n1.page_get, self.n1.page_set = self.original
+        self.original = None
+
+    def reset(self) -> None:
+        """Clear all counters and the call stack"""
+
+        self.executions[:] = [0] * 0x10000
+        self.cycles[:] = [0] * 0x10000
+        self.opcode_executions[:] = [0] * len(OPCODES)
+        self.opcode_cycles[:] = [0] * len(OPCODES)
+        self.reads.update(dict.fromkeys(REGIONS, 0))
+        self.writes.update(dict.fromkeys(REGIONS, 0))
+
+        self.frames[:] = [(ROOT, ADDR_STACK)]
+        self.frame_key = ROOT
+        self.stacks.clear()
+
+    def count_get(self, get: Callable[[int], int], region: str) -> Callable[[int], int]:
+
+        reads = self.reads
+
+        def counted(addr: int) -> int:
+            reads[region] += 1
+            return get(addr)
+
+        return counted
+
+    def count_set(self, set_: Callable[[int, int], None], region: str) -> Callable[[int, int], None]:
+
+        writes = self.writes
+
+        def counted(addr: int, value: int) -> None:
+            writes[region] += 1
+            set_(addr, value)
+
+        return counted
+
+    def instrument(self, handler: Callable[[], int], opcode: int) -> Callable[[], int]:
+        """Wrap a handler to count its execution, which is specialized by the kind of instruction"""
+
+        n1 = self.n1
+        executions, cycles = self.executions, self.cycles
+        opcode_executions, opcode_cycles = self.opcode_executions, self.opcode_cycles
+        stacks = self.stacks
+        name = OPCODES[opcode].name
+
+        def count(pc: int, used: int) -> None:
+            executions[pc] += 1
+            cycles[pc] += used
+            opcode_executions[opcode] += 1
+            opcode_cycles[opcode] += used
+            stacks[self.frame_key] = stacks.get(self.frame_key, 0) + used
+
+        if name in ("jnz", "jmp"):
+            def run() -> int:
+                pc = n1.pc
+                used = handler()
+                count(pc, used)
+                self.jumped(n1.pc)
+                return used
+
+        elif name in ("pushi", "pushr", "pop"):
+            counter = self.reads if name == "pop" else self.writes
+            def run() -> int:
+                pc = n1.pc
+                used = handler()
+                count(pc, used)
+                counter["stack"] += 1
+                return used
+
+        else:
+            def run() -> int:
+                pc = n1.pc
+                used = handler()
+                count(pc, used)
+                return used
+
+        return run
+
+    def jumped(self, target: int) -> None:
+        """Leave all frames, whose return address was popped, and enter a function at the target
+
+        A function is only entered, if the stack grew since the current frame was entered, so a
+        return address was pushed. Loops and tail jumps to a function stay in the current frame.
+        """
+
+        frames = self.frames
+        sp = self.n1.sp
+        changed = False
+
+        while len(frames) > 1 and sp < frames[-1][1]:
+            frames.pop()
+            changed = True
+
+        if target in self.functions and sp > frames[-1][1]:
+            frames.append((self.functions[target], sp))
+            changed = True
+
+        if not changed:
+            return
+
+        self.frame_key = ";".join(name for name, _ in frames)
+
+    def function(self, addr: int) -> str:
+        """Get the name of the function containing an address"""
+
+        index = bisect_right(self.function_addrs, addr)
+
+        return self.functions[self.function_addrs[index - 1]] if index else ROOT
+
+    def hotspots(self, count: int = 20) -> list[dict]:
+        """Get the addresses with the most cycles"""
+
+        addrs = sorted((addr for addr in range(0x10000) if self.executions[addr]),
+                       key=lambda addr: (-self.cycles[addr], addr))[:count]
+
+        rom = self.n1.rom
+        hotspots = []
+
+        for addr in addrs:
+            hotspot = {"addr": addr, "executions": self.executions[addr], "cycles": self.cycles[addr]}
+            if addr - ADDR_ROM < len(rom):
+                hotspot["instruction"] = OPCODES[rom[addr - ADDR_ROM] >> 3].name
+            if self.functions:
+                hotspot["function"] = self.function(addr)
+            hotspots.append(hotspot)
+
+        return hotspots
+
+    def opcodes(self) -> list[dict]:
+        """Get the executed opcodes sorted by cycles"""
+
+        opcodes = [{"instruction": OPCODES[opcode].name, "executions": self.opcode_executions[opcode],
+                    "cycles": self.opcode_cycles[opcode]}
+                   for opcode in range(len(OPCODES)) if self.opcode_executions[opcode]]
+
+        return sorted(opcodes, key=lambda opcode: -opcode["cycles"])
+
+    def summary(self, count: int = 20) -> dict:
+        return {"hotspots": self.hotspots(count), "opcodes": self.opcodes(),
+                "reads": dict(self.reads), "writes": dict(self.writes)}
+
+    def report(self, count: int = 20) -> str:
+        """Format a text report of the hot spots, opcodes and memory accesses"""
+
+        total = sum(self.opcode_cycles) or 1
+
+        lines = ["--- Hot Spots ---", "", "Addr    Executions  Cycles      Share  Instruction"]
+        for hotspot in self.hotspots(count):
+            function = f"  ({hotspot['function']})" if "function" in hotspot else ""
+            lines.append(f"0x{hotspot['addr']:04X}  {hotspot['executions']:<10}  {hotspot['cycles']:<10}  "
+                         f"{hotspot['cycles'] / total:>5.1%}  {hotspot.get('instruction', '?')}{function}")
+
+        lines += ["", "--- Opcodes ---", "", "Instruction  Executions  Cycles      Share"]
+        for opcode in self.opcodes():
+            lines.append(f"{opcode['instruction']:<11}  {opcode['executions']:<10}  {opcode['cycles']:<10}  "
+                         f"{opcode['cycles'] / total:>5.1%}")
+
+        lines += ["", "--- Memory ---", "", "Region   Reads       Writes"]
+        for region in REGIONS:
+            lines.append(f"{region:<7}  {self.reads[region]:<10}  {self.writes[region]}")
+
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self) -> str:
+        """Format the cycles per call stack in the collapsed format of flamegraph tools"""
+
+        return "".join(f"{stack} {cycles}\n" for stack, cycles in sorted(self.stacks.items()))
+
+    def write_report(self, path: str, count: int = 20) -> None:
+
+        with open(path, "w") as f:
+            f.write(self.report(count))
+
+    def write_collapsed(self, path: str) -> None:
+
+        with open(path, "w") as f:
+            f.write(self.collapsed())
@@ -0,0 +1,154 @@
+# Standard modules
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable
+
+# Local modules
+from common import *
+
+if TYPE_CHECKING:
+    from n1 import N1
+
+
+# Size of a copy-on-write page in bytes
+PAGE = 0x100
+
+
+def capture_pages(memory: memoryview, base: tuple[bytes, ...] | None,
+                  dirty: Iterable[int] | None = None) -> tuple[tuple[bytes, ...], int]:
+    """Split memory into pages and reuse all pages of the base, which didn't change
+
+    With the indices of the written pages, only they are compared and copied, else all pages.
+    Return the pages and the number of bytes of the newly copied pages.
+    """
+
+    if base is None:
+        return tuple(bytes(memory[offset:offset + PAGE]) for offset in range(0, len(memory), PAGE)), len(memory)
+
+    pages = list(base)
+    size = 0
+
+    for i in range(len(pages)) if dirty is None else dirty:
+        chunk = memory[i * PAGE:(i + 1) * PAGE]
+        if base[i] != chunk:
+            pages[i] = bytes(chunk)
+            size += len(chunk)
+
+    return tuple(pages), size
+
+
+def dirty_pages(pages: Iterable[int], start: int, end: int) -> list[int]:
+    """Get the page indices in the region [start, end) of the written address pages"""
+    return [page - (start >> 8) for page in pages if start >> 8 <= page < end + PAGE - 1 >> 8]
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    """Save state of the machine, which shares all unchanged pages with the previous snapshot"""
+
+    registers: bytes
+    pc: int
+    sp: int
+    stack_peak: int
+    mb: int
+    exit: int
+    cycles: int
+    ram: tuple[bytes, ...]
+    stack: tuple[bytes, ...]
+    banks: dict[int, tuple[bytes, ...]]
+    devices: dict[int, object]
+    size: int
+
+    @classmethod
+    def capture(cls, n1: N1, base: Snapshot | None = None) -> Snapshot:
+        """Capture the machine state and share the unchanged pages with the base
+
+        If the base is the last snapshot of the machine, only the pages written since then
+        are compared and copied, else all pages.
+        """
+
+        tracked = base is not None and base is n1.last_snapshot
+
+        dirty_banks: dict[int, list[int]] = {}
+        for key in n1.dirty_banks:
+            dirty_banks.setdefault(key >> 8, []).append((key & 0xFF) - (ADDR_BANK >> 8))
+
+        ram, size = capture_pages(n1.ram, base.ram if base is not None else None,
+                                  dirty_pages(n1.dirty, ADDR_RAM, ADDR_RAM + SIZE_RAM) if tracked else None)
+        stack, stack_size = capture_pages(n1.stack, base.stack if base is not None else None,
+                                          dirty_pages(n1.dirty, ADDR_STACK, ADDR_STACK + SIZE_STACK) if tracked else None)
+        size += stack_size
+
+        banks = {}
+        for number, bank in n1.banks.items():
+            pages, bank_size = capture_pages(bank, base.banks.get(number) if base is not None else None,
+                                             dirty_banks.get(number, ()) if tracked else None)
+            banks[number] = pages
+            size += bank_size
+
+        return cls(bytes(n1.registers), n1.pc, n1.sp, n1.stack_peak, n1.mb, n1.exit, n1.cycles, ram, stack, banks,
+                   n1.bus.save_state(), size)
+
+    def shared(self, other: Snapshot) -> int:
+        """Get the number of bytes of the pages shared with another snapshot"""
+
+        size = sum(len(page) for page, other_page in zip(self.ram, other.ram) if page is other_page)
+        size += sum(len(page) for page, other_page in zip(self.stack, other.stack) if page is other_page)
+
+        for number, pages in self.banks.items():
+            other_pages = other.banks.get(number, ())
+            size += sum(len(page) for page, other_page in zip(pages, other_pages) if page is other_page)
+
+        return size
+
+
+class Rewind:
+    """Ring buffer of snapshots with a fixed memory budget in bytes to step backwards in time"""
+
+    def __init__(self, n1: N1, budget: int = 0x1000000) -> None:
+
+        self.n1: N1 = n1
+        self.budget: int = budget
+
+        self.snapshots: deque[Snapshot] = deque()
+        self.sizes: deque[int] = deque()
+        self.memory: int = 0
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def record(self) -> Snapshot:
+        """Take a snapshot and drop the oldest snapshots, until the buffer fits into the budget"""
+
+        snapshot = self.n1.snapshot()
+
+        self.snapshots.append(snapshot)
+        self.sizes.append(snapshot.size)
+        self.memory += snapshot.size
+
+        while self.memory > self.budget and len(self.snapshots) > 1:
+
+            oldest = self.snapshots.popleft()
+            self.memory -= self.sizes.popleft()
+
+            # Pages shared with the dropped snapshot are now owned by its successor
+            shared = self.snapshots[0].shared(oldest)
+            self.sizes[0] += shared
+            self.memory += shared
+
+        return snapshot
+
+    def rewind(self, steps: int = 1) -> bool:
+        """Restore the snapshot the given number of steps before the newest one and drop all newer ones"""
+
+        if steps >= len(self.snapshots):
+            return False
+
+        for _ in range(steps):
+            self.snapshots.pop()
+            self.memory -= self.sizes.pop()
+
+        self.n1.restore(self.snapshots[-1])
+
+        return True
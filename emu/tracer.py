@@ -0,0 +1,258 @@
+# Standard modules
+from typing import Callable, Iterator, NamedTuple, BinaryIO
+import struct
+
+# External libraries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Local modules
+from common import *
+from n1 import N1, R_F
+
+
+MAGIC = b"N1T\0"
+VERSION = 1
+
+# Magic, version, record size
+HEADER = struct.Struct("<4sBB")
+
+# PC, instruction byte, operand 1, operand 2, mask, register, register value, flags, write address, write value
+RECORD = struct.Struct("<HBBBBBBBHB")
+
+FIELDS = ("pc", "byte", "operand1", "operand2", "mask", "register", "value", "flags", "addr", "data")
+
+# Bits of the mask field, which tell if the register and write fields are valid
+MASK_REGISTER = 1
+MASK_WRITE = 2
+
+# Instructions, which write their register argument or the flags register
+WRITE_REGISTER = {"mvi", "mvr", "lda", "ldhl", "pop", "ini", "inr", "addi", "addr", "adci", "adcr", "andi",
+                  "andr", "ori", "orr", "nori", "norr", "sbbi", "sbbr", "shl", "shr"}
+WRITE_FLAGS = {opcode.name for opcode in OPCODES if opcode.flags} - WRITE_REGISTER
+
+
+class Row(NamedTuple):
+    """Decoded trace record"""
+
+    pc: int
+    byte: int
+    operand1: int
+    operand2: int
+    mask: int
+    register: int
+    value: int
+    flags: int
+    addr: int
+    data: int
+
+
+def dtype() -> "np.dtype":
+    """Get the NumPy structured data type of a trace record"""
+
+    return np.dtype([("pc", "<u2"), ("byte", "u1"), ("operand1", "u1"), ("operand2", "u1"), ("mask", "u1"),
+                     ("register", "u1"), ("value", "u1"), ("flags", "u1"), ("addr", "<u2"), ("data", "u1")])
+
+
+def decode(data: bytes) -> Iterator[Row]:
+    """Decode raw trace records into rows"""
+
+    for record in RECORD.iter_unpack(data):
+        yield Row._make(record)
+
+
+def to_array(data: bytes) -> "np.ndarray":
+    """Decode raw trace records into a NumPy structured array without copying"""
+
+    if np is None:
+        raise ValueError("Decoding a trace into an array requires NumPy!")
+
+    return np.frombuffer(data, dtype())
+
+
+def read_header(f: BinaryIO) -> None:
+
+    magic, version, size = HEADER.unpack(f.read(HEADER.size).ljust(HEADER.size, b"\0"))
+
+    if magic != MAGIC:
+        raise ValueError("Invalid trace! Wrong magic number.")
+    if version != VERSION or size != RECORD.size:
+        raise ValueError(f"Invalid trace! Unsupported version {version}.")
+
+
+def read_file(path: str) -> bytes:
+    """Read the raw records of a trace file"""
+
+    with open(path, "rb") as f:
+        read_header(f)
+        return f.read()
+
+
+def map_file(path: str) -> "np.ndarray":
+    """Map a trace file as NumPy structured array, so large traces are not loaded into memory"""
+
+    if np is None:
+        raise ValueError("Mapping a trace requires NumPy!")
+
+    with open(path, "rb") as f:
+        read_header(f)
+
+    return np.memmap(path, dtype(), "r", HEADER.size)
+
+
+class Tracer:
+    """Trace recorder, which swaps an instrumented dispatch table into the machine
+
+    Every instruction appends a fixed-width record to a preallocated ring buffer. If a
+    path is given, full buffers are written to the file, else the oldest records are
+    overwritten. Like the profiler, it needs the interpreter instead of translated blocks.
+    """
+
+    def __init__(self, n1: N1, capacity: int = 0x10000, path: str | None = None) -> None:
+
+        self.n1: N1 = n1
+        self.capacity: int = capacity
+
+        self.buffer: bytearray = bytearray(capacity * RECORD.size)
+        self.position: int = 0
+        self.wrapped: bool = False
+        self.count: int = 0
+
+        self.file: BinaryIO | None = None
+        if path is not None:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+        self.write: tuple[int, int] | None = None
+
+        self.original: tuple[list, list] | None = None
+
+    @property
+    def attached(self) -> bool:
+        return self.original is not None
+
+    def attach(self) -> None:
+        """Swap the recording tables into the machine"""
+
+        if self.attached:
+            return
+
+        n1 = self.n1
+        self.original = (n1.dispatch, n1.page_set)
+
+        n1.dispatch = [self.instrument(handler, byte) for byte, handler in enumerate(n1.dispatch)]
+        n1.page_set = [self.watch(set_) for set_ in n1.page_set]
+
+    def detach(self) -> None:
+        """Restore the original tables and write the buffered records to the file"""
+
+        if not self.attached:
+            return
+
+        self.n1.dispatch, self.n1.page_set = self.original
+        self.original = None
+
+        self.flush()
+
+    def close(self) -> None:
+
+        self.detach()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def flush(self) -> None:
+        """Write the buffered records to the file"""
+
+        if self.file is None:
+            return
+
+        self.file.write(self.buffer[:self.position * RECORD.size])
+        self.file.flush()
+        self.position = 0
+
+    def records(self) -> bytes:
+        """Get the buffered records from the oldest to the newest"""
+
+        end = self.position * RECORD.size
+
+        if self.wrapped:
+            return bytes(self.buffer[end:] + self.buffer[:end])
+
+        return bytes(self.buffer[:end])
+
+    def rows(self) -> list[Row]:
+        return list(decode(self.records()))
+
+    def array(self) -> "np.ndarray":
+        return to_array(self.records())
+
+    def watch(self, set_: Callable[[int, int], None]) -> Callable[[int, int], None]:
+
+        def traced(addr: int, value: int) -> None:
+            self.write = (addr, value)
+            set_(addr, value)
+
+        return traced
+
+    def instrument(self, handler: Callable[[], int], byte: int) -> Callable[[], int]:
+        """Wrap a handler to record its execution"""
+
+        n1 = self.n1
+        registers = n1.registers
+        peek = n1.peek
+        name, length = OPCODES[byte >> 3].name, OPCODES[byte >> 3].length
+
+        register = -1
+        if name in WRITE_REGISTER:
+            register = byte & 0b111
+        elif name in WRITE_FLAGS:
+            register = R_F
+
+        push = name in ("pushi", "pushr")
+
+        def run() -> int:
+
+            pc = n1.pc
+            sp = n1.sp
+            operand1 = peek(pc + 1 & 0xFFFF) if length > 1 else 0
+            operand2 = peek(pc + 2 & 0xFFFF) if length > 2 else 0
+
+            self.write = None
+            used = handler()
+
+            if push and n1.sp != sp:
+                self.write = (sp, n1.memory[sp])
+
+            mask = 0
+            value = 0
+            if register != -1:
+                mask = MASK_REGISTER
+                value = registers[register]
+
+            addr, data = 0, 0
+            if self.write is not None:
+                mask |= MASK_WRITE
+                addr, data = self.write
+
+            self.append(pc, byte, operand1, operand2, mask, max(register, 0), value, registers[R_F], addr, data)
+
+            return used
+
+        return run
+
+    def append(self, *record: int) -> None:
+
+        if self.position == self.capacity:
+            if self.file is not None:
+                self.flush()
+            else:
+                self.position = 0
+                self.wrapped = True
+
+        RECORD.pack_into(self.buffer, self.position * RECORD.size, *record)
+        self.position += 1
+        self.count += 1
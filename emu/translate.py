@@ -0,0 +1,273 @@
+# Standard modules
+from dataclasses import dataclass
+from typing import Callable
+
+# Local modules
+from common import *
+from n1 import N1, R_H, R_L, R_F
+from alu import ADD, SBB, CMP, SHL, SHR, CARRY_SHIFT, BORROW_SHIFT
+
+
+# Maximum number of instructions in a translated block
+MAX_BLOCK_LENGTH = 64
+
+
+@dataclass(slots=True)
+class Block:
+    """Translated basic block with its entry address, size in bytes and instruction count"""
+
+    pc: int
+    size: int
+    instructions: int
+    function: Callable[[N1], int]
+    source: str
+    hits: int = 0
+
+
+class Translator:
+    """Basic block translation cache, which compiles ROM code into Python functions
+
+    A block starts at an entry address and ends after a jump, an output to the exit port
+    or an output to a register port. Registers are kept in local variables within a block.
+    Code outside of the ROM is executed by the interpreter, because it can change.
+    Blocks are split before breakpoints, which are executed by the interpreter too.
+    """
+
+    def __init__(self, n1: N1) -> None:
+
+        self.n1: N1 = n1
+        self.rom: memoryview = n1.rom
+
+        self.blocks: dict[int, Block] = {}
+
+        self.breakpoints: frozenset[int] = frozenset()
+        self.installed: frozenset[int] = self.breakpoints
+
+        self.hits: int = 0
+        self.compiled: int = 0
+        self.covered: int = 0
+        self.interpreted: int = 0
+
+    def flush(self) -> None:
+        """Remove all translated blocks, e.g. after a new ROM was loaded"""
+
+        self.blocks.clear()
+        self.rom = self.n1.rom
+        self.covered = 0
+
+        self.installed = self.breakpoints
+        for addr in self.installed:
+            self.blocks[addr] = Block(addr, 0, 1, N1.step, "")
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "compiled": self.compiled, "covered": self.covered,
+                "interpreted": self.interpreted}
+
+    def run(self, n: int = 1) -> int:
+        """Execute at least n instructions (whole blocks) and return the number of executed instructions"""
+
+        n1 = self.n1
+        blocks = self.blocks
+
+        if self.rom is not n1.rom or self.installed is not self.breakpoints:
+            self.flush()
+
+        executed = 0
+
+        while executed < n and n1.exit == -1:
+
+            pc = n1.pc
+
+            block = blocks.get(pc)
+            if block is None:
+                if not ADDR_ROM <= pc <= ADDR_ROM + SIZE_ROM - 3:
+                    self.interpreted += 1
+                    executed += n1.step()
+                    continue
+                block = self.translate(pc)
+
+            block.hits += 1
+            self.hits += 1
+            executed += block.function(n1)
+
+        return executed
+
+    def run_until_exit(self) -> int:
+        """Execute blocks until the machine exits and return the exit code"""
+
+        while self.n1.exit == -1:
+            self.run(0x10000)
+
+        return self.n1.exit
+
+    def translate(self, pc: int) -> Block:
+        """Translate the basic block at an address into a Python function and cache it"""
+
+        n1 = self.n1
+        entry = pc
+
+        body: list[str] = []
+        used: set[str] = set()
+        written: set[str] = set()
+        cycles = 0
+        count = 0
+        end = False
+
+        def register(code: int) -> str:
+            name = REGISTER_NAME[code & 0b111]
+            used.add(name)
+            return "r_" + name
+
+        def target(name: str) -> str:
+            written.add(name)
+            return register(REGISTER_CODE[name])
+
+        def writeback(next_pc: int, expression: str = "") -> str:
+            expression = expression or str(next_pc & 0xFFFF)
+            return f"<WRITEBACK>n1.pc = {expression}; n1.cycles += {cycles}; return {count}"
+
+        def check() -> None:
+            body.append("    if n1.exit != -1:")
+            body.append("        " + writeback(pc + length))
+
+        while count < MAX_BLOCK_LENGTH:
+
+            if count and pc in self.breakpoints:
+                break
+
+            byte = n1.addr_get(pc)
+            opcode = OPCODES[byte >> 3]
+            name, length = opcode.name, opcode.length
+
+            if pc + length > ADDR_ROM + SIZE_ROM:
+                break
+
+            operand = [n1.addr_get(pc + i) for i in range(1, length)]
+            r = REGISTER_NAME[byte & 0b111]
+
+            cycles += opcode.cycles
+            count += 1
+            end = False
+
+            match name:
+                case "mvi":
+                    body.append(f"    {target(r)} = {operand[0]}")
+                case "mvr":
+                    source = register(operand[0])
+                    body.append(f"    {target(r)} = {source}")
+                case "lda":
+                    addr = operand[0] << 8 | operand[1]
+                    if ADDR_ROM <= addr < ADDR_ROM + SIZE_ROM:
+                        body.append(f"    {target(r)} = {n1.addr_get(addr)}")
+                    else:
+                        body.append(f"    n1.pc = {pc}")
+                        body.append(f"    {target(r)} = addr_get({addr})")
+                        check()
+                case "ldhl":
+                    h, l = register(R_H), register(R_L)
+                    body.append(f"    n1.pc = {pc}")
+                    body.append(f"    {target(r)} = addr_get({h} << 8 | {l})")
+                    check()
+                case "sta":
+                    body.append(f"    n1.pc = {pc}")
+                    body.append(f"    addr_set({operand[0] << 8 | operand[1]}, {register(byte)})")
+                    check()
+                case "sthl":
+                    h, l = register(R_H), register(R_L)
+                    body.append(f"    n1.pc = {pc}")
+                    body.append(f"    addr_set({h} << 8 | {l}, {register(byte)})")
+                    check()
+                case "pushi":
+                    body.append(f"    push({operand[0]})")
+                    check()
+                case "pushr":
+                    body.append(f"    push({register(byte)})")
+                    check()
+                case "pop":
+                    body.append(f"    {target(r)} = pop()")
+                    check()
+                case "nop":
+                    pass
+                case "jnz":
+                    h, l = register(R_H), register(R_L)
+                    condition = register(byte)
+                    body.append("    " + writeback(0, f"{h} << 8 | {l} if {condition} else {pc + length & 0xFFFF}"))
+                    end = True
+                case "jmp":
+                    h, l = register(R_H), register(R_L)
+                    body.append("    " + writeback(0, f"{h} << 8 | {l}"))
+                    end = True
+                case "ini":
+                    body.append(f"    {target(r)} = port_get({operand[0]})")
+                    check()
+                case "inr":
+                    port = register(operand[0])
+                    body.append(f"    {target(r)} = port_get({port})")
+                    check()
+                case "outi":
+                    body.append(f"    port_set({operand[0]}, {register(byte)})")
+                    if operand[0] == PORT_EXIT:
+                        body.append("    " + writeback(pc + length))
+                        end = True
+                    else:
+                        check()
+                case "outr":
+                    port = register(operand[0])
+                    body.append(f"    port_set({port}, {register(byte)})")
+                    body.append("    " + writeback(pc + length))
+                    end = True
+                case "addi" | "addr" | "adci" | "adcr" | "sbbi" | "sbbr":
+                    value = operand[0] << 1 if name.endswith("i") else register(operand[0]) + " << 1"
+                    table = "SBB" if name.startswith("sbb") else "ADD"
+                    carry = ""
+                    if name.startswith(("adc", "sbb")):
+                        shift = BORROW_SHIFT if name.startswith("sbb") else CARRY_SHIFT
+                        carry = f" | {register(R_F)} >> {shift} & 1"
+                    a = register(byte)
+                    body.append(f"    t = {table}[{a} << 9 | {value}{carry}]")
+                    body.append(f"    {target(r)} = t & 0xFF")
+                    body.append(f"    {target('f')} = t >> 8")
+                case "cmpi" | "cmpr":
+                    value = operand[0] if name.endswith("i") else register(operand[0])
+                    a = register(byte)
+                    body.append(f"    {target('f')} = CMP[{a} << 8 | {value}]")
+                case "andi" | "andr" | "ori" | "orr":
+                    value = operand[0] if name.endswith("i") else register(operand[0])
+                    operator = "&" if name.startswith("and") else "|"
+                    body.append(f"    {target(r)} {operator}= {value}")
+                case "nori" | "norr":
+                    value = operand[0] if name.endswith("i") else register(operand[0])
+                    a = register(byte)
+                    body.append(f"    {target(r)} = ~({a} | {value}) & 0xFF")
+                case "shl" | "shr":
+                    a = register(byte)
+                    body.append(f"    t = {name.upper()}[{a}]")
+                    body.append(f"    {target(r)} = t & 0xFF")
+                    body.append(f"    {target('f')} = t >> 8")
+
+            pc += length
+
+            if end:
+                break
+
+        if not end:
+            body.append("    " + writeback(pc))
+
+        load = "".join(f"    r_{name} = registers[{REGISTER_CODE[name]}]\n" for name in sorted(used))
+        store = "".join(f"registers[{REGISTER_CODE[name]}] = r_{name}; " for name in sorted(written))
+
+        source = f"def block_{entry:04x}(n1):\n    registers = n1.registers\n" + load + \
+                 "\n".join(body).replace("<WRITEBACK>", store) + "\n"
+
+        namespace = {"addr_get": n1.addr_get, "addr_set": n1.addr_set, "push": n1.push, "pop": n1.pop,
+                     "port_get": n1.bus.read, "port_set": n1.bus.write,
+                     "ADD": ADD, "SBB": SBB, "CMP": CMP, "SHL": SHL, "SHR": SHR}
+        exec(compile(source, f"<block {entry:04x}>", "exec"), namespace)
+
+        block = Block(entry, pc - entry, count, namespace[f"block_{entry:04x}"], source)
+
+        self.blocks[entry] = block
+        self.compiled += 1
+        self.covered += block.size
+
+        return block
@@ -1,10 +1,16 @@
 # Standard modules
 from __future__ import annotations
+from collections import OrderedDict
 import threading as th
 
 # External libraries
 import pygame as pg
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Local modules
 from constants import *
 from common import *
@@ -23,6 +29,14 @@ class Win(th.Thread):
         self.screen: pg.Surface = pg.Surface((0, 0))
 
         self.font: pg.font.Font = None
+        self.text: TextCache = None
+        self.background: pg.Surface = None
+        self.display: Display = None
+
+        self.fields: dict[tuple[int, int], tuple[str, pg.Rect]] = {}
+
+        self.prompt: str | None = None
+        self.message: str = ""
 
         self.running = True
 
@@ -34,15 +48,23 @@ class Win(th.Thread):
 
         self.screen = pg.display.set_mode((W_WIDTH, W_HEIGHT))
 
+        self.text = TextCache(self.font)
+        self.background = self.render_background()
+        self.display = Display()
+
+        self.invalidate()
+
         while self.running:
 
-            self.clock.tick(30)
+            self.clock.tick(W_FPS)
 
             for event in pg.event.get():
                 self.event(event)
 
             self.render()
 
+        self.glob.cpu.running = False
+
         pg.quit()
 
     def event(self, event: pg.event.Event) -> None:
@@ -50,48 +72,233 @@ class Win(th.Thread):
         if event.type == pg.QUIT:
             self.running = False
 
-    def render(self) -> None:
+        elif event.type == pg.WINDOWEXPOSED:
+            self.invalidate()
 
-        self.screen.fill(C_BG1)
+        elif event.type == pg.KEYDOWN and self.prompt is not None:
+            self.prompt_key(event)
 
-        exit_str = "----" if self.glob.n1.exit == -1 else "0x" + number2str(self.glob.n1.exit, 2)
-        self.screen.blit(self.font.render("Exit", True, C_FG3), (5, 524))
-        self.screen.blit(self.font.render(exit_str, True, C_FG1), (60, 524))
+        elif event.type == pg.KEYDOWN:
+            self.debug_key(event.key)
 
-        for i, r in enumerate("abcdhlzf"):
-            r_str = "0x" + number2str(self.glob.n1.registers[r], 2)
-            self.screen.blit(self.font.render(r.upper(), True, C_FG3), (5, 550 + i * 18))
-            self.screen.blit(self.font.render(r_str, True, C_FG1), (60, 550 + i * 18))
+    def debug_key(self, key: int) -> None:
+        """Control the debugger: F5 pause/resume, F6 command, F8 clear, F9 toggle breakpoint at PC, F10 step"""
+
+        debugger = self.glob.debugger
+
+        if key == pg.K_F5:
+            if debugger.stopped:
+                debugger.resume()
+            else:
+                debugger.pause()
 
-        pc_str = "0x" + number2str(self.glob.n1.pc[0], 2) + number2str(self.glob.n1.pc[1], 2)
-        self.screen.blit(self.font.render("PC", True, C_FG3), (120, 524))
-        self.screen.blit(self.font.render(pc_str, True, C_FG1), (175, 524))
+        elif key == pg.K_F6:
+            self.prompt = ""
 
-        sp_str = "0x" + number2str(self.glob.n1.sp[0], 2) + number2str(self.glob.n1.sp[1], 2)
-        self.screen.blit(self.font.render("SP", True, C_FG3), (120, 550))
-        self.screen.blit(self.font.render(sp_str, True, C_FG1), (175, 550))
+        elif key == pg.K_F8:
+            debugger.clear()
 
-        mb_str = "0x" + number2str(self.glob.n1.mb, 2)
-        self.screen.blit(self.font.render("MB", True, C_FG3), (120, 576))
-        self.screen.blit(self.font.render(mb_str, True, C_FG1), (175, 576))
+        # The PC is only valid while the CPU is stopped, because the state of the window lags behind
+        elif key == pg.K_F9 and debugger.stopped:
+            pc = self.glob.n1.pc
+            self.message = ("break" if debugger.toggle_breakpoint(pc) else "removed") + f" 0x{pc:04X}"
 
-        self.screen.blit(render_display(None), (3, 3))
+        elif key == pg.K_F10 and debugger.stopped:
+            self.glob.cpu.steps += 1
+
+    def prompt_key(self, event: pg.event.Event) -> None:
+        """Edit the debugger command: Enter executes it, Escape cancels it"""
+
+        if event.key == pg.K_RETURN:
+            try:
+                self.message = self.glob.debugger.command(self.prompt)
+            except ValueError as e:
+                self.message = str(e)
+            self.prompt = None
+
+        elif event.key == pg.K_ESCAPE:
+            self.prompt = None
+
+        elif event.key == pg.K_BACKSPACE:
+            self.prompt = self.prompt[:-1]
+
+        elif event.unicode.isprintable() and len(self.prompt) < 40:
+            self.prompt += event.unicode
+
+    def invalidate(self) -> None:
+        """Draw the whole window again in the next frame"""
+
+        self.fields.clear()
+
+        self.screen.blit(self.background, (0, 0))
+        self.screen.blit(self.display.surface, (3, 3))
 
         pg.display.flip()
 
+    def render_background(self) -> pg.Surface:
+        """Render the background with the static labels of the register panel"""
+
+        surf: pg.Surface = pg.Surface((W_WIDTH, W_HEIGHT))
 
-def render_display(n1: N1) -> None:
+        surf.fill(C_BG1)
 
-    surf: pg.Surface = pg.Surface((D_WIDTH * P_WIDTH + 4, D_HEIGHT * P_HEIGHT + 4))
+        surf.blit(self.text.render("Exit", C_FG3), (5, 524))
 
-    pg.draw.rect(surf, C_LAMP_OFF, (2, 2, D_WIDTH * P_WIDTH, D_HEIGHT * P_HEIGHT))
-    #pg.draw.rect(surf, C_LAMP_ON, (2, 2, D_WIDTH * P_WIDTH, D_HEIGHT * P_HEIGHT))
+        for i, r in enumerate("abcdhlzf"):
+            surf.blit(self.text.render(r.upper(), C_FG3), (5, 550 + i * 18))
 
-    for x in range(D_WIDTH):
-        for y in range(D_HEIGHT):
-            pg.draw.rect(surf, C_LAMP_BORDER, (2 + x * P_WIDTH, 2 + y * P_HEIGHT, P_WIDTH, P_HEIGHT), 1)
-            
-    pg.draw.rect(surf, C_BORDER, (1, 1, D_WIDTH * P_WIDTH + 2, D_HEIGHT * P_HEIGHT + 2), 2)
+        surf.blit(self.text.render("PC", C_FG3), (120, 524))
+        surf.blit(self.text.render("SP", C_FG3), (120, 550))
+        surf.blit(self.text.render("MB", C_FG3), (120, 576))
+        surf.blit(self.text.render("Stop", C_FG3), (120, 602))
 
-    return surf
+        surf.blit(self.text.render("Cmd", C_FG3), (330, 524))
+        surf.blit(self.text.render("Info", C_FG3), (330, 550))
+
+        return surf
+
+    def render(self) -> None:
+
+        state = self.glob.cpu.state
+
+        dirty: list[pg.Rect] = []
+
+        exit_str = "----" if state.exit < 0 else "0x" + number2str(state.exit, 2)
+        dirty += self.render_field((60, 524), exit_str)
+
+        for i, value in enumerate(state.registers):
+            r_str = "0x" + number2str(value, 2)
+            dirty += self.render_field((60, 550 + i * 18), r_str)
+
+        dirty += self.render_field((175, 524), "0x" + number2str(state.pc, 4))
+        dirty += self.render_field((175, 550), "0x" + number2str(state.sp, 4))
+        dirty += self.render_field((175, 576), "0x" + number2str(state.mb, 2))
+        dirty += self.render_field((175, 602), self.glob.debugger.reason or "----")
+
+        dirty += self.render_field((385, 524), "F6" if self.prompt is None else "> " + self.prompt + "_")
+        dirty += self.render_field((385, 550), self.message[:60] or "----")
+
+        if self.display.update(state.vram):
+            dirty.append(self.screen.blit(self.display.surface, (3, 3)))
+
+        if dirty:
+            pg.display.update(dirty)
+
+    def render_field(self, position: tuple[int, int], value: str) -> list[pg.Rect]:
+        """Render a value of the register panel, if it changed since the last frame"""
+
+        old = self.fields.get(position)
+
+        if old is not None and old[0] == value:
+            return []
+
+        surf = self.text.render(value, C_FG1)
+        rect = surf.get_rect(topleft=position)
+        dirty = rect if old is None else rect.union(old[1])
+
+        self.screen.blit(self.background, dirty, dirty)
+        self.screen.blit(surf, position)
+
+        self.fields[position] = value, rect
 
+        return [dirty]
+
+
+class TextCache:
+    """Cache of rendered text surfaces by string and color with least recently used eviction"""
+
+    def __init__(self, font: pg.font.Font, size: int = 256) -> None:
+
+        self.font: pg.font.Font = font
+        self.size: int = size
+
+        self.surfaces: OrderedDict[tuple[str, tuple[int, int, int]], pg.Surface] = OrderedDict()
+
+    def render(self, text: str, color: tuple[int, int, int]) -> pg.Surface:
+
+        key = text, color
+
+        surf = self.surfaces.get(key)
+
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            return surf
+
+        surf = self.font.render(text, True, color)
+
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+
+        return surf
+
+
+class Display:
+    """Lamp display, which is drawn once and then only updates the lamps changed in VRAM"""
+
+    def __init__(self) -> None:
+
+        self.surface: pg.Surface = pg.Surface((D_WIDTH * P_WIDTH + 4, D_HEIGHT * P_HEIGHT + 4))
+        self.lamps: pg.Surface = self.surface.subsurface((2, 2, D_WIDTH * P_WIDTH, D_HEIGHT * P_HEIGHT))
+
+        self.lamp_on: pg.Surface = render_lamp(C_LAMP_ON)
+        self.lamp_off: pg.Surface = render_lamp(C_LAMP_OFF)
+
+        self.vram: bytes = bytes(D_SIZE)
+        self.redraws: int = 0
+
+        for x in range(D_WIDTH):
+            for y in range(D_HEIGHT):
+                self.lamps.blit(self.lamp_off, (x * P_WIDTH, y * P_HEIGHT))
+
+        pg.draw.rect(self.surface, C_BORDER, (1, 1, D_WIDTH * P_WIDTH + 2, D_HEIGHT * P_HEIGHT + 2), 1)
+
+        if np is not None:
+            self.pixels_on = np.tile(pg.surfarray.array3d(self.lamp_on), (D_WIDTH, D_HEIGHT, 1))
+            self.pixels_off = np.tile(pg.surfarray.array3d(self.lamp_off), (D_WIDTH, D_HEIGHT, 1))
+
+    def update(self, vram: bytes) -> bool:
+        """Update the lamps, which changed since the last frame, and return if anything changed"""
+
+        if vram == self.vram:
+            return False
+
+        if np is not None:
+            changed = np.flatnonzero(np.frombuffer(vram, np.uint8) != np.frombuffer(self.vram, np.uint8))
+        else:
+            changed = [i for i in range(D_SIZE) if vram[i] != self.vram[i]]
+
+        if np is not None and len(changed) >= D_FULL_REDRAW:
+            self.redraw(vram)
+        else:
+            for i in changed:
+                y, column = divmod(int(i), D_ROW)
+                diff = vram[i] ^ self.vram[i]
+                for bit in range(8):
+                    if diff & 0x80 >> bit:
+                        lamp = self.lamp_on if vram[i] & 0x80 >> bit else self.lamp_off
+                        self.lamps.blit(lamp, ((column * 8 + bit) * P_WIDTH, y * P_HEIGHT))
+
+        self.vram = vram
+
+        return True
+
+    def redraw(self, vram: bytes) -> None:
+        """Redraw all lamps with one blit of the whole bitmap"""
+
+        bits = np.unpackbits(np.frombuffer(vram, np.uint8)).reshape(D_HEIGHT, D_WIDTH).T
+        bits = bits.repeat(P_WIDTH, 0).repeat(P_HEIGHT, 1)[:, :, np.newaxis]
+
+        pg.surfarray.blit_array(self.lamps, np.where(bits, self.pixels_on, self.pixels_off))
+
+        self.redraws += 1
+
+
+def render_lamp(color: tuple[int, int, int]) -> pg.Surface:
+
+    surf: pg.Surface = pg.Surface((P_WIDTH, P_HEIGHT))
+
+    surf.fill(color)
+    pg.draw.rect(surf, C_LAMP_BORDER, (0, 0, P_WIDTH, P_HEIGHT), 1)
+
+    return surf